@@ -0,0 +1,355 @@
+"""Animated mosaics from GIFs, animated PNG/WebP and short video clips.
+
+    python3 animation.py clip.gif board.gif --width 64 --height 48
+
+Frames are streamed: each one is resized to the board, and only the cells
+whose color moved more than --threshold levels (in any channel) since they
+were last matched are matched again; the rest keep their bricks. Output
+frames cover just the changed cells, and frames with no change extend the
+previous frame's duration, so neither the input nor the output is ever held
+in memory as a whole. Write .gif, or .png/.apng for an animated PNG.
+Video input needs OpenCV.
+"""
+import argparse
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+from PIL import GifImagePlugin, Image, ImageSequence
+
+from dither import ordered_dither
+from imaging import bgr_to_rgb, opencv
+from instrument import Instrumentation
+from mosaic import Mosaic
+from render import GRID_COLOR, SCALE_FACTOR, render_indices, render_paletted
+from tiles import COMPRESS_LEVEL, png_chunk, png_scanlines
+
+VIDEO_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.avi', '.mkv', '.webm')
+
+# A cell is matched again once any channel has moved this far from the color it was matched for
+CHANGE_THRESHOLD = 8
+
+# Frame duration when the source does not give one
+DEFAULT_DURATION = 100
+
+
+def read_frames(path):
+    """Yield (RGB array, duration in ms) for each frame of an animation or video, one at a time."""
+    if os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS:
+        cv2 = opencv()
+        if cv2 is None:
+            raise RuntimeError("Reading video needs OpenCV (opencv-python)")
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise ValueError(f"Could not open video: {path}")
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        duration = 1000 / fps if fps > 0 else DEFAULT_DURATION
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield bgr_to_rgb(frame), duration
+        finally:
+            capture.release()
+        return
+
+    with Image.open(path) as img:
+        for frame in ImageSequence.Iterator(img):
+            duration = frame.info.get('duration') or DEFAULT_DURATION
+            yield np.asarray(frame.convert('RGB')), duration
+
+
+def changed_box(changed):
+    """(x0, y0, x1, y1) cell bounds of the True entries of a 2D mask, or None if there are none."""
+    rows = np.flatnonzero(changed.any(axis=1))
+    if not len(rows):
+        return None
+    columns = np.flatnonzero(changed.any(axis=0))
+    return columns[0], rows[0], columns[-1] + 1, rows[-1] + 1
+
+
+def frame_mosaics(generator, frames, width, height, threshold=CHANGE_THRESHOLD, dither=None,
+                  max_colors=None):
+    """Yield (Mosaic, changed mask, duration) for each (RGB frame, duration) in ``frames``.
+
+    The first frame is matched in full. After that a cell is matched again
+    only when its resized color differs from the color it was last matched
+    for by more than ``threshold`` in some channel; threshold 0 gives the
+    same boards as generating every frame on its own. ``dither`` may be
+    'bayer', which keeps bricks in place between frames; error diffusion
+    would ripple every change across the board. With ``max_colors`` the
+    palette is fitted to the first frame and kept for the rest.
+    """
+    if dither not in (None, 'none', 'bayer'):
+        raise ValueError("Only ordered ('bayer') dithering can be used on animations")
+    instrumentation = generator.instrumentation
+    palette = generator.palette
+    matched = None
+    indices = None
+
+    for frame, duration in frames:
+        rgb = generator.crop_and_resize(frame, width, height)
+        if max_colors and indices is None:
+            with instrumentation.stage('fit_palette'):
+                palette = generator.fit_palette(rgb, max_colors)
+
+        if matched is None:
+            changed = np.ones((height, width), dtype=bool)
+        else:
+            with instrumentation.stage('diff'):
+                changed = np.abs(rgb.astype(np.int16) - matched).max(axis=2) > threshold
+
+        with instrumentation.stage('match'):
+            if matched is None:
+                matched = rgb.astype(np.int16)
+            else:
+                matched[changed] = rgb[changed]
+            if dither == 'bayer':
+                # Identity match: just the offset colors, of which the changed ones are matched
+                rgb = ordered_dither(rgb, lambda offset: offset)
+            new_indices = generator.match_colors(rgb[changed], palette=palette)
+            if indices is None:
+                indices = np.empty((height, width), dtype=new_indices.dtype)
+            indices[changed] = new_indices
+        instrumentation.count('cells_matched', len(new_indices))
+        instrumentation.count('cells_reused', changed.size - len(new_indices))
+
+        yield Mosaic(indices, palette), changed, duration
+
+
+class _FrameWriter:
+    """Shared frame bookkeeping: a frame is held back until the next one shows whether it lasts longer."""
+
+    def __init__(self, path, scale_factor=SCALE_FACTOR, show_grid=True, show_studs=True,
+                 grid_color=GRID_COLOR):
+        self.path = path
+        self.scale_factor = scale_factor
+        self.show_grid = show_grid
+        self.show_studs = show_studs
+        self.grid_color = grid_color
+        self.frames = 0
+        self._file = None
+        self._pending = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def add(self, mosaic, changed, duration):
+        """Queue one frame; only the cells in ``changed`` are redrawn."""
+        box = changed_box(changed)
+        if self._pending is None:
+            self._file = open(self.path, 'wb')
+            self._start(mosaic)
+            box = (0, 0, mosaic.width, mosaic.height)
+            changed = np.ones(mosaic.shape, dtype=bool)
+        elif box is None:
+            self._pending[3] += duration
+            return
+        else:
+            self._flush()
+        x0, y0, x1, y1 = box
+        # Copies: the caller updates its arrays in place for the next frame
+        self._pending = [
+            mosaic.indices[y0:y1, x0:x1].copy(), changed[y0:y1, x0:x1].copy(),
+            mosaic.palette.rgb, duration, box,
+        ]
+
+    def close(self):
+        if self._file is None:
+            return
+        try:
+            if self._pending is not None:
+                self._flush()
+            self._finish()
+        finally:
+            self._file.close()
+            self._file = None
+
+    def _flush(self):
+        indices, changed, palette_rgb, duration, box = self._pending
+        offset = (box[0] * self.scale_factor, box[1] * self.scale_factor)
+        self._write_frame(indices, changed, palette_rgb, offset, duration)
+        self.frames += 1
+
+
+class GifWriter(_FrameWriter):
+    """Streams an animated GIF that loops forever. Each frame carries its own color table.
+
+    Unchanged cells inside a frame's area are left transparent, which
+    compresses to almost nothing. A frame needing more than 256 colors
+    (over 127 bricks in the changed area, with studs) is reduced to 256
+    colors with Pillow's quantizer and drawn in full.
+    """
+
+    def _start(self, mosaic):
+        size = (mosaic.width * self.scale_factor, mosaic.height * self.scale_factor)
+        # No global color table; the NETSCAPE2.0 extension makes the animation loop
+        self._file.write(b'GIF89a' + struct.pack('<HHBBB', *size, 0, 0, 0))
+        self._file.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', 0) + b'\x00')
+
+    def _write_frame(self, indices, changed, palette_rgb, offset, duration):
+        image = render_paletted(
+            indices, palette_rgb, self.scale_factor, self.show_grid, self.show_studs, self.grid_color
+        )
+        if image is None:
+            image = render_indices(
+                indices, palette_rgb, self.scale_factor, self.show_grid, self.show_studs, self.grid_color
+            ).quantize(256, dither=Image.Dither.NONE)
+
+        params = {}
+        colors = len(image.getpalette()) // 3
+        if colors < 256 and not changed.all():
+            # Spare palette slot marks the pixels of unchanged cells
+            pixels = np.array(image)
+            scale = self.scale_factor
+            pixels[np.repeat(np.repeat(~changed, scale, axis=0), scale, axis=1)] = colors
+            palette = image.getpalette() + [0, 0, 0]
+            image = Image.fromarray(pixels, 'P')
+            image.putpalette(palette)
+            params['transparency'] = colors
+
+        # Disposal 1 leaves the frame in place for the next, smaller one to draw over
+        data = GifImagePlugin.getdata(
+            image, offset, duration=min(round(duration), 655350), disposal=1,
+            include_color_table=True, **params
+        )
+        self._file.write(b''.join(data))
+
+    def _finish(self):
+        self._file.write(b';')
+
+
+class ApngWriter(_FrameWriter):
+    """Streams a looping animated PNG in 8-bit RGB; the frame count is filled in when it is closed."""
+
+    compress_level = COMPRESS_LEVEL
+
+    def _start(self, mosaic):
+        size = (mosaic.width * self.scale_factor, mosaic.height * self.scale_factor)
+        self._sequence = 0
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        self._file.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', *size, 8, 2, 0, 0, 0)))
+        # acTL: frame count (patched in _finish) and 0 plays, i.e. loop forever
+        self._actl_offset = self._file.tell()
+        self._file.write(png_chunk(b'acTL', struct.pack('>II', 1, 0)))
+
+    def _write_frame(self, indices, changed, palette_rgb, offset, duration):
+        pixels = np.asarray(render_indices(
+            indices, palette_rgb, self.scale_factor, self.show_grid, self.show_studs, self.grid_color
+        ))
+        height, width = pixels.shape[:2]
+        # Delay as a fraction of a second: milliseconds over 1000, capped to fit 16 bits
+        delay = min(round(duration), 65535)
+        # dispose_op 0 and blend_op 0: the frame replaces its area and stays
+        self._file.write(png_chunk(b'fcTL', struct.pack(
+            '>IIIIIHHBB', self._sequence, width, height, *offset, delay, 1000, 0, 0
+        )))
+        self._sequence += 1
+
+        data = zlib.compress(png_scanlines(pixels), self.compress_level)
+        if self.frames == 0:
+            self._file.write(png_chunk(b'IDAT', data))
+        else:
+            self._file.write(png_chunk(b'fdAT', struct.pack('>I', self._sequence) + data))
+            self._sequence += 1
+
+    def _finish(self):
+        self._file.write(png_chunk(b'IEND', b''))
+        self._file.seek(self._actl_offset)
+        self._file.write(png_chunk(b'acTL', struct.pack('>II', self.frames, 0)))
+
+
+def animation_writer(path, **options):
+    """GifWriter or ApngWriter, chosen by the output file's extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.gif':
+        return GifWriter(path, **options)
+    if extension in ('.png', '.apng'):
+        return ApngWriter(path, **options)
+    raise ValueError(f"Unsupported animation format: {extension} (use .gif, .png or .apng)")
+
+
+def write_animation(generator, input_path, output_path, width, height, threshold=CHANGE_THRESHOLD,
+                    dither=None, max_colors=None, show_grid=True, show_studs=True):
+    """Turn an animation or video into an animated mosaic; returns a summary dict with frames/s.
+
+    Stage timings and counters are recorded on the generator's
+    instrumentation when one is attached.
+    """
+    instrumentation = generator.instrumentation
+    start = time.perf_counter()
+    frames = 0
+    writer = animation_writer(output_path, show_grid=show_grid, show_studs=show_studs)
+    with writer:
+        mosaics = frame_mosaics(
+            generator, read_frames(input_path), width, height, threshold, dither, max_colors
+        )
+        for mosaic, changed, duration in mosaics:
+            frames += 1
+            with instrumentation.stage('write'):
+                writer.add(mosaic, changed, duration)
+    if not frames:
+        raise ValueError(f"No frames could be read from {input_path}")
+
+    seconds = time.perf_counter() - start
+    return {
+        'frames': frames,
+        'frames_written': writer.frames,
+        'seconds': seconds,
+        'frames_per_second': frames / seconds if seconds else None,
+    }
+
+
+def main(argv=None):
+    from generator import BasicMosaicGenerator
+
+    parser = argparse.ArgumentParser(
+        description="Turn a GIF, animated PNG/WebP or video into an animated Lego mosaic.",
+        epilog=__doc__.split('\n\n', 1)[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('input', help="GIF, animated PNG/WebP or video file")
+    parser.add_argument('output', help="animated .gif, .png or .apng to write")
+    parser.add_argument('--width', type=int, default=32, help="board width in studs (default 32)")
+    parser.add_argument('--height', type=int, default=64, help="board height in studs (default 64)")
+    parser.add_argument('--threshold', type=int, default=CHANGE_THRESHOLD,
+                        help=f"color change that makes a cell be matched again (default {CHANGE_THRESHOLD})")
+    parser.add_argument('--dither', choices=['none', 'bayer'], default='none',
+                        help="ordered dithering (error diffusion would flicker)")
+    parser.add_argument('--colors', type=int, default=0, metavar='N',
+                        help="limit the animation to N colors fitted to the first frame")
+    parser.add_argument('--no-grid', action='store_true', help="do not draw grid lines")
+    parser.add_argument('--no-studs', action='store_true', help="do not draw studs")
+    parser.add_argument('--no-lut', action='store_true', help="ignore a cached RGB lookup table")
+    parser.add_argument('--stats', action='store_true', help="print stage timings and counters")
+    args = parser.parse_args(argv)
+
+    generator = BasicMosaicGenerator(instrumentation=Instrumentation())
+    if not args.no_lut:
+        generator.load_lookup_table(build=False)
+    try:
+        summary = write_animation(
+            generator, args.input, args.output, args.width, args.height, args.threshold,
+            args.dither, args.colors or None, not args.no_grid, not args.no_studs,
+        )
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    print(f"{summary['frames']} frames ({summary['frames_written']} written) in "
+          f"{summary['seconds']:.2f} s: {summary['frames_per_second']:.1f} frames/s")
+    if args.stats:
+        print(generator.instrumentation.report())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+"""Generate mosaics without the GUI.
+
+Examples:
+    python3 batch.py photos/ --width 48 --height 48 --output-dir boards
+    python3 batch.py "photos/*.jpg" --workers 8 --parts json
+    python3 batch.py jobs.json
+    python3 batch.py wall.jpg --width 2000 --height 1500 --stream --plates 32
+    python3 batch.py wall.jpg --width 256 --height 192 --merge --stock stock.json
+    python3 batch.py photos/ --format webp --fast
+
+A JSON manifest is either a list of jobs or an object with "jobs" and
+optional "defaults". Each job has "image" and may set "width", "height",
+"grid", "studs", "dither", "colors", "stream", "plates", "merge" and "output"; relative paths are
+taken from the manifest's directory; its extension picks the format (see export.OUTPUT_FORMATS).
+Streamed jobs may write .tif, and .npz writes the palette indices without rendering. A --stock file is
+JSON as taken by bricks.merge_bricks, e.g. {"2x4": 500, "Red": {"2x2": 40}}.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bricks import merge_bricks
+from dither import DITHER_METHODS
+from export import FAST_COMPRESS_LEVEL, output_format, save_image, save_mosaic
+from metrics import METRICS
+from generator import SUPPORTED_EXTENSIONS
+from instrument import Instrumentation
+from render import SCALE_FACTOR
+from tiles import COMPRESS_LEVEL, write_baseplate_tiles, write_striped
+from workers import init_worker, worker_generator
+
+# Functions listed per job by --profile
+PROFILE_LINES = 15
+
+def find_images(pattern):
+    """Image paths for a directory, a glob pattern or a single file."""
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+    else:
+        paths = glob.glob(pattern)
+    return sorted(path for path in paths if path.lower().endswith(SUPPORTED_EXTENSIONS))
+
+
+def load_manifest(path, defaults):
+    """Jobs from a JSON manifest, with manifest and command-line defaults filled in."""
+    with open(path) as f:
+        manifest = json.load(f)
+    if isinstance(manifest, dict):
+        defaults = {**defaults, **manifest.get('defaults', {})}
+        manifest = manifest.get('jobs', [])
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    for entry in manifest:
+        job = {**defaults, **entry}
+        job['image'] = os.path.join(base_dir, job['image'])
+        if job.get('output'):
+            job['output'] = os.path.join(base_dir, job['output'])
+        jobs.append(job)
+    return jobs
+
+
+def collect_jobs(inputs, defaults):
+    """Expand every command-line input (manifest, directory, glob or file) into jobs."""
+    jobs = []
+    for item in inputs:
+        if item.lower().endswith('.json'):
+            jobs.extend(load_manifest(item, defaults))
+        else:
+            jobs.extend({**defaults, 'image': path} for path in find_images(item))
+    return jobs
+
+
+def output_paths(job, output_dir):
+    """Output image path for a job and the stem shared by its parts list."""
+    if job.get('output'):
+        png_path = job['output']
+    else:
+        stem = os.path.splitext(os.path.basename(job['image']))[0]
+        extension = job.get('format', 'png')
+        png_path = os.path.join(output_dir, f"{stem}_{job['width']}x{job['height']}.{extension}")
+    return png_path, os.path.splitext(png_path)[0] + '_parts'
+
+
+def run_job(job, output_dir, parts_format, profile=False):
+    """Generate, render and save one mosaic; returns per-stage timings and counters."""
+    generator = worker_generator()
+    png_path, parts_stem = output_paths(job, output_dir)
+    file_format = output_format(png_path)
+    os.makedirs(os.path.dirname(png_path) or '.', exist_ok=True)
+
+    if job.get('stream') and job.get('colors'):
+        raise ValueError("A color limit cannot be combined with streaming")
+    if job.get('merge') and (job.get('stream') or job.get('plates')):
+        raise ValueError("Merged bricks cannot be streamed or split into baseplates")
+
+    # Fresh timers and counters for every job; the generator reports decode, resize and match itself
+    instrumentation = Instrumentation(profile=profile)
+    generator.instrumentation = instrumentation
+    stage = instrumentation.stage
+
+    start = time.perf_counter()
+    if job.get('stream'):
+        mosaic = generator.generate_mosaic_striped(
+            job['image'], job['width'], job['height'], dither=job.get('dither')
+        )
+    else:
+        mosaic = generator.generate_mosaic(
+            job['image'], job['width'], job['height'], dither=job.get('dither'), max_colors=job.get('colors')
+        )
+
+    layout = None
+    if job.get('merge'):
+        with stage('merge'):
+            layout = merge_bricks(mosaic, stock=job.get('stock'))
+
+    compress_level = job.get('compress_level')
+    if file_format == 'NPZ':
+        # Just the palette indices; nothing is rendered
+        with stage('encode'):
+            mosaic.save(png_path, job.get('fast'))
+    elif job.get('stream'):
+        # Render and compress a strip at a time; the whole board image never exists
+        if compress_level is None:
+            compress_level = FAST_COMPRESS_LEVEL if job.get('fast') else COMPRESS_LEVEL
+        with stage('render'):
+            write_striped(mosaic, png_path, SCALE_FACTOR, job.get('grid', True), job.get('studs', True),
+                          compress_level=compress_level)
+    elif layout is not None:
+        with stage('render'):
+            image = layout.render(SCALE_FACTOR, job.get('grid', True), job.get('studs', True))
+        with stage('encode'):
+            save_image(image, png_path, file_format, compress_level, job.get('fast'))
+    else:
+        save_mosaic(
+            mosaic, png_path, SCALE_FACTOR, job.get('grid', True), job.get('studs', True),
+            compress_level=compress_level, fast=job.get('fast'), file_format=file_format,
+            instrumentation=instrumentation,
+        )
+
+    if job.get('plates'):
+        with stage('plates'):
+            write_baseplate_tiles(
+                mosaic, os.path.splitext(png_path)[0] + '_plates', job['plates'],
+                SCALE_FACTOR, job.get('grid', True), job.get('studs', True),
+            )
+
+    parts = generator.parts_list(mosaic) if layout is None else layout.parts_list()
+    with stage('export'):
+        if parts_format == 'csv':
+            parts.to_csv(parts_stem + '.csv')
+        elif parts_format == 'json':
+            parts.to_json(parts_stem + '.json')
+
+    return {
+        'image': job['image'],
+        'output': png_path,
+        'cells': job['width'] * job['height'],
+        'timings': instrumentation.timings,
+        'counters': instrumentation.counters,
+        'profile': instrumentation.profile_report(PROFILE_LINES),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def run_jobs(jobs, output_dir, parts_format='csv', workers=None, use_lut=True, profile=False,
+             metric='blend', prefilter=None):
+    """Run jobs across ``workers`` processes, yielding (job, result or exception) as they finish."""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        init_worker(use_lut, metric, prefilter)
+        for job in jobs:
+            try:
+                yield job, run_job(job, output_dir, parts_format, profile)
+            except Exception as e:
+                yield job, e
+        return
+
+    initargs = (use_lut, metric, prefilter)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs) as pool:
+        futures = [(job, pool.submit(run_job, job, output_dir, parts_format, profile)) for job in jobs]
+        for job, future in futures:
+            try:
+                yield job, future.result()
+            except Exception as e:
+                yield job, e
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate Lego mosaics from images without the GUI.",
+        epilog=__doc__.split('\n\n', 1)[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('inputs', nargs='+', help="image files, directories, glob patterns or JSON manifests")
+    parser.add_argument('--width', type=int, default=32, help="board width in studs (default 32)")
+    parser.add_argument('--height', type=int, default=64, help="board height in studs (default 64)")
+    parser.add_argument('--output-dir', default='output', help="where rendered images go (default output/)")
+    parser.add_argument('--no-grid', action='store_true', help="do not draw grid lines")
+    parser.add_argument('--no-studs', action='store_true', help="do not draw studs")
+    parser.add_argument('--parts', choices=['csv', 'json', 'none'], default='csv',
+                        help="parts list format written next to each image (default csv)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all CPUs)")
+    parser.add_argument('--no-lut', action='store_true', help="ignore a cached RGB lookup table")
+    parser.add_argument('--stats', action='store_true',
+                        help="print pixel, cache and palette comparison counters for each job")
+    parser.add_argument('--profile', action='store_true',
+                        help="run generation under cProfile and print the top functions for each job")
+    parser.add_argument('--dither', choices=DITHER_METHODS, default='none',
+                        help="dithering method (default none)")
+    parser.add_argument('--colors', type=int, default=0, metavar='N',
+                        help="use at most N palette colors, chosen per image (default: no limit)")
+    parser.add_argument('--stream', action='store_true',
+                        help="match and render in strips to bound memory on very large boards")
+    parser.add_argument('--plates', type=int, default=0, metavar='SIZE',
+                        help="also write per-baseplate instruction tiles of SIZE x SIZE studs")
+    parser.add_argument('--merge', action='store_true',
+                        help="merge same-color cells into larger plates (2x4, 2x2, 1x4, ...)")
+    parser.add_argument('--stock', metavar='FILE',
+                        help="JSON plate counts available to --merge, by size and optionally by color")
+    parser.add_argument('--format', choices=['png', 'webp', 'npz', 'jpg', 'tif'], default='png',
+                        help="output format: indexed PNG, lossless WebP, raw palette indices, ... (default png)")
+    parser.add_argument('--compress-level', type=int, choices=range(10), default=None, metavar='0-9',
+                        help="PNG zlib level (default 6, or 1 with --fast)")
+    parser.add_argument('--fast', action='store_true',
+                        help="favor encoding speed over file size")
+    parser.add_argument('--metric', choices=METRICS, default='blend',
+                        help="color distance used for matching (default blend)")
+    parser.add_argument('--prefilter', type=int, default=None, metavar='K',
+                        help="score cie94/ciede2000 only on the K nearest colors in CIE76 (default: all)")
+    args = parser.parse_args(argv)
+    if args.prefilter is not None and args.prefilter < 1:
+        parser.error("--prefilter must be at least 1")
+
+    stock = None
+    if args.stock:
+        with open(args.stock) as f:
+            stock = json.load(f)
+
+    defaults = {
+        'width': args.width, 'height': args.height, 'grid': not args.no_grid, 'studs': not args.no_studs,
+        'dither': args.dither, 'colors': args.colors, 'stream': args.stream, 'plates': args.plates,
+        'merge': args.merge, 'stock': stock, 'format': args.format,
+        'compress_level': args.compress_level, 'fast': args.fast,
+    }
+    jobs = collect_jobs(args.inputs, defaults)
+    if not jobs:
+        print("No images found.", file=sys.stderr)
+        return 1
+
+    failures = 0
+    cells = 0
+    start = time.perf_counter()
+    results = run_jobs(
+        jobs, args.output_dir, args.parts, args.workers, not args.no_lut, args.profile,
+        args.metric, args.prefilter,
+    )
+    for job, result in results:
+        if isinstance(result, Exception):
+            failures += 1
+            print(f"FAILED {job['image']}: {result}", file=sys.stderr)
+            continue
+        cells += result['cells']
+        stages = ' '.join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in result['timings'].items())
+        print(f"{result['output']}  {job['width']}x{job['height']}  {result['seconds']:.2f}s  ({stages})")
+        if args.stats:
+            print('    ' + ' '.join(f"{name}={value:,}" for name, value in result['counters'].items()))
+        if args.profile:
+            print(result['profile'])
+    elapsed = time.perf_counter() - start
+
+    done = len(jobs) - failures
+    print(
+        f"\n{done}/{len(jobs)} mosaics in {elapsed:.2f}s: "
+        f"{done / elapsed:.2f} jobs/s, {cells / elapsed:,.0f} cells/s"
+    )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
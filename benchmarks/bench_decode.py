@@ -0,0 +1,122 @@
+"""Measure the reduced-resolution JPEG decode used by resize_image.
+
+Each photo is loaded and resized once with the full decode and once with the
+reduced decode, each in a fresh process so that peak memory can be compared.
+Without photos a synthetic 24-megapixel JPEG is generated.
+
+Usage: python3 benchmarks/bench_decode.py [photo.jpg ...] [--width 64 --height 32]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def synthetic_photo(path, width=6000, height=4000, seed=0):
+    """Write a smooth JPEG with some noise, roughly like a camera photo."""
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    channels = [
+        127 + 100 * np.sin(x / (300 + 100 * c) + c) * np.cos(y / (250 + 80 * c))
+        for c in range(3)
+    ]
+    img = np.stack(channels, axis=-1) + rng.normal(0, 8, (height, width, 3))
+    cv2.imwrite(path, np.clip(img, 0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 92])
+
+
+def peak_rss_kb(reset=False):
+    """Peak resident memory of this process in kB.
+
+    On Linux the high-water mark can be reset, so that memory touched while
+    importing does not hide the decode; elsewhere the lifetime peak is used.
+    """
+    try:
+        if reset:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(path, width, height, reduced, repeats):
+    """Run in a child process: best load+resize time, peak RSS growth and the resized image."""
+    from generator import BasicMosaicGenerator
+
+    generator = BasicMosaicGenerator(reduced_decode=reduced)
+    baseline = peak_rss_kb(reset=True)
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        resized = generator.resize_image(path, width, height)
+        best = min(best, time.perf_counter() - start)
+    peak = peak_rss_kb()
+    return {
+        'seconds': best,
+        'peak_kb': peak - baseline,
+        'reduction': generator.decode_reduction(path, width, height),
+        'resized': resized.tolist(),
+    }
+
+
+def run_child(path, width, height, reduced, repeats):
+    args = [sys.executable, os.path.abspath(__file__), path, '--width', str(width),
+            '--height', str(height), '--repeats', str(repeats), '--child']
+    if not reduced:
+        args.append('--full')
+    output = subprocess.run(args, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('photos', nargs='*')
+    parser.add_argument('--width', type=int, default=64)
+    parser.add_argument('--height', type=int, default=32)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--full', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = measure(args.photos[0], args.width, args.height, not args.full, args.repeats)
+        print(json.dumps(result))
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        photos = args.photos
+        if not photos:
+            photos = [os.path.join(temp_dir, 'synthetic.jpg')]
+            synthetic_photo(photos[0])
+
+        print(f"{'photo':>20} {'scale':>6} {'full ms':>9} {'reduced ms':>11} "
+              f"{'full MB':>8} {'reduced MB':>11} {'max diff':>9} {'mean diff':>10}")
+        for path in photos:
+            full = run_child(path, args.width, args.height, False, args.repeats)
+            reduced = run_child(path, args.width, args.height, True, args.repeats)
+            diff = np.abs(np.array(full['resized'], dtype=int) - np.array(reduced['resized'], dtype=int))
+            print(
+                f"{os.path.basename(path)[-20:]:>20} 1/{reduced['reduction']:<4} "
+                f"{full['seconds'] * 1000:>9.1f} {reduced['seconds'] * 1000:>11.1f} "
+                f"{full['peak_kb'] / 1024:>8.1f} {reduced['peak_kb'] / 1024:>11.1f} "
+                f"{diff.max():>9} {diff.mean():>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Compare the speed of each matching metric, and how often the CIE76 prefilter changes the result.
+
+Random colors are matched against the generator's palette with every
+metric: by a full scan, and for CIE94 and CIEDE2000 also through the
+prefilter with each --candidates value. Agreement is the share of colors
+given the same entry as the full scan of the same metric.
+
+Usage: python3 benchmarks/bench_metrics.py [--colors 50000] [--candidates 4 8 16]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generator import BasicMosaicGenerator  # noqa: E402
+from metrics import METRICS  # noqa: E402
+from palette import CompiledPalette  # noqa: E402
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--colors', type=int, default=50000, help="random colors matched (default 50000)")
+    parser.add_argument('--candidates', type=int, nargs='+', default=[4, 8, 16],
+                        help="prefilter sizes to try (default 4 8 16)")
+    args = parser.parse_args()
+
+    colors = np.random.default_rng(0).integers(0, 256, size=(args.colors, 3))
+    basic_colors = BasicMosaicGenerator().basic_colors
+
+    print(f"{'metric':<10} {'prefilter':>9} {'seconds':>9} {'colors/s':>12} {'agreement':>10}")
+    for metric in METRICS:
+        palette = CompiledPalette(basic_colors, metric)
+        seconds, exact = timed(palette.scan_nearest, colors)
+        print(f"{metric:<10} {'-':>9} {seconds:>9.3f} {len(colors) / seconds:>12,.0f} {'':>10}")
+        if metric not in ('cie94', 'ciede2000'):
+            continue
+        for candidates in args.candidates:
+            seconds, approximate = timed(palette.prefilter_nearest, colors, candidates)
+            agreement = np.mean(approximate == exact)
+            print(f"{metric:<10} {candidates:>9} {seconds:>9.3f} {len(colors) / seconds:>12,.0f} {agreement:>10.2%}")
+
+
+if __name__ == "__main__":
+    main()
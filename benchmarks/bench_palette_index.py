@@ -0,0 +1,67 @@
+"""Compare the k-d tree palette search against the full scan.
+
+Usage: python3 benchmarks/bench_palette_index.py [--pixels N] [--sizes 50 300 ...]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from palette import CompiledPalette, PaletteIndex  # noqa: E402
+
+# Name prefixes so that the family bonuses take part in the search
+FAMILIES = ('Green', 'Orange', 'Gray', 'Blue', 'Red')
+
+
+def random_palette(size, rng):
+    """A palette of ``size`` distinct random colors."""
+    keys = rng.choice(1 << 24, size=size, replace=False)
+    colors = {}
+    for i, key in enumerate(keys.tolist()):
+        colors[f"{FAMILIES[i % len(FAMILIES)]}_{i}"] = (key >> 16, (key >> 8) & 0xFF, key & 0xFF)
+    return CompiledPalette(colors)
+
+
+def best_of(repeats, func, *args):
+    """Fastest wall time of several runs, and the last result."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pixels', type=int, default=4096, help="random colors matched per run")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 300, 3000, 30000])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    colors = rng.integers(0, 256, size=(args.pixels, 3))
+
+    # Keep the one-off scikit-learn import out of the build timings
+    PaletteIndex(random_palette(8, rng))
+
+    print(f"{'palette':>8} {'scan ms':>10} {'index ms':>10} {'build ms':>10} {'speedup':>8}  match")
+    for size in args.sizes:
+        palette = random_palette(size, rng)
+        build_time, index = best_of(1, PaletteIndex, palette)
+        scan_time, expected = best_of(args.repeats, palette.scan_nearest, colors)
+        index_time, found = best_of(args.repeats, index.nearest, colors)
+        print(
+            f"{size:>8} {scan_time * 1000:>10.1f} {index_time * 1000:>10.1f} "
+            f"{build_time * 1000:>10.1f} {scan_time / index_time:>7.1f}x  "
+            f"{'identical' if np.array_equal(expected, found) else 'MISMATCH'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
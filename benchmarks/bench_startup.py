@@ -0,0 +1,68 @@
+"""Report the import time of each project module and its heavy dependencies.
+
+Every module is imported in a fresh interpreter with -X importtime, so the
+times are cold (apart from the OS file cache) and include everything the
+module pulls in. The fastest of several runs is shown, with the slowest
+imports underneath it.
+
+Usage: python3 benchmarks/bench_startup.py [--repeats 5] [--top 3] [module ...]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Third-party dependencies first, then the project modules from the bottom up.
+# main.py is left out because importing it opens the Tk window.
+MODULES = [
+    'numpy', 'PIL.Image', 'cv2', 'sklearn.cluster', 'tkinter',
+    'metrics', 'palette', 'lut', 'cache', 'mosaic', 'parts', 'render', 'dither', 'tiles', 'imaging',
+    'generator', 'workers', 'batch',
+]
+
+
+def import_times(module):
+    """{imported name: (self us, cumulative us)} for one cold import of module."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        return None
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--top', type=int, default=3, help="slowest imports listed under each module")
+    args = parser.parse_args()
+
+    print(f"{'module':<20} {'import ms':>10}  slowest imports (cumulative ms)")
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.repeats)]
+        if runs[0] is None:
+            print(f"{module:<20} {'missing':>10}")
+            continue
+        best = min(runs, key=lambda times: times[module][1])
+
+        # Heaviest dependencies that are not nested inside another listed one
+        dependencies = sorted(
+            (name for name in best if name != module and '.' not in name),
+            key=lambda name: best[name][1], reverse=True,
+        )[:args.top]
+        details = ', '.join(f"{name} {best[name][1] / 1000:.0f}" for name in dependencies)
+        print(f"{module:<20} {best[module][1] / 1000:>10.1f}  {details}")
+
+
+if __name__ == "__main__":
+    main()
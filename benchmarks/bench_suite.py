@@ -0,0 +1,223 @@
+"""Time each stage of mosaic generation on synthetic images and write the results as JSON.
+
+Stages, each timed on its own:
+  resize     resize_image (decode, crop, INTER_AREA), per source pixel
+  generate   generate_mosaic (resize and match), per mosaic cell
+  match      find_closest_color on a sample of pixels, one call each
+  render     render_mosaic at SCALE_FACTOR with grid and studs, per output pixel
+  count      parts_list (color counting), per mosaic cell
+
+The images are a smooth gradient, uniform noise and flat color regions.
+Every image is run at every board size and palette size. Times are the best
+of --repeats runs. Peak memory is measured in a separate run under
+tracemalloc, so tracing does not slow the timed runs.
+
+Usage:
+  python3 benchmarks/bench_suite.py --output before.json
+  python3 benchmarks/bench_suite.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from generator import BasicMosaicGenerator  # noqa: E402
+from imaging import opencv  # noqa: E402
+from render import SCALE_FACTOR, render_mosaic  # noqa: E402
+
+IMAGE_KINDS = ('gradient', 'noise', 'flat')
+
+# Pixels passed one by one to find_closest_color in the match stage
+MATCH_SAMPLE = 2000
+
+
+def synthetic_image(kind, width, height, seed=0):
+    """(height, width, 3) uint8 RGB test image of the given kind."""
+    rng = np.random.default_rng(seed)
+    if kind == 'gradient':
+        y, x = np.mgrid[0:height, 0:width]
+        return np.stack([
+            255 * x / max(1, width - 1),
+            255 * y / max(1, height - 1),
+            255 * (x + y) / max(1, width + height - 2),
+        ], axis=-1).astype(np.uint8)
+    if kind == 'noise':
+        return rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    if kind == 'flat':
+        # A coarse grid of random solid colors
+        cells = rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+        rows = np.arange(height) * 8 // height
+        columns = np.arange(width) * 8 // width
+        return cells[rows[:, None], columns[None, :]]
+    raise ValueError(f"Unknown image kind: {kind}")
+
+
+def palette_colors(generator, size, seed=0):
+    """basic_colors trimmed to ``size`` entries, or padded with random colors beyond its length."""
+    colors = dict(generator.basic_colors)
+    if size is None:
+        return colors
+    rng = np.random.default_rng(seed)
+    names = list(colors)
+    if size <= len(names):
+        keep = sorted(rng.choice(len(names), size=size, replace=False).tolist())
+        return {names[i]: colors[names[i]] for i in keep}
+    for i, key in enumerate(rng.choice(1 << 24, size=size - len(names), replace=False).tolist()):
+        colors[f"Random_{i}"] = (key >> 16, (key >> 8) & 0xFF, key & 0xFF)
+    return colors
+
+
+def timed(repeats, func, *args):
+    """Best wall time over ``repeats`` calls, and the last result."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def peak_memory(func, *args):
+    """Peak bytes allocated (Python and NumPy) during one call."""
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def match_sample(generator, rgb_image):
+    """find_closest_color on up to MATCH_SAMPLE pixels, one scalar call each."""
+    pixels = rgb_image.reshape(-1, 3)[:MATCH_SAMPLE].tolist()
+    return [generator.find_closest_color(tuple(pixel)) for pixel in pixels]
+
+
+def run_case(generator, image_path, width, height, repeats):
+    """Result rows for every stage of one image, board size and palette."""
+    source_pixels = int(np.prod(Image.open(image_path).size))
+    cells = width * height
+    resized = generator.resize_image(image_path, width, height)
+    mosaic = generator.generate_mosaic(image_path, width, height)
+
+    stages = [
+        ('resize', source_pixels, generator.resize_image, (image_path, width, height)),
+        ('generate', cells, generator.generate_mosaic, (image_path, width, height)),
+        ('match', min(MATCH_SAMPLE, cells), match_sample, (generator, resized[..., ::-1])),
+        ('render', cells * SCALE_FACTOR ** 2, render_mosaic, (mosaic,)),
+        ('count', cells, generator.parts_list, (mosaic,)),
+    ]
+    rows = []
+    for stage, pixels, func, args in stages:
+        seconds, _ = timed(repeats, func, *args)
+        rows.append({
+            'stage': stage,
+            'seconds': seconds,
+            'pixels': pixels,
+            'pixels_per_second': pixels / seconds if seconds else None,
+            'peak_bytes': peak_memory(func, *args),
+        })
+    return rows
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_key(row):
+    return (row['image'], row['board'], row['palette'], row['stage'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        epilog=__doc__.split('\n\n', 1)[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--images', nargs='+', choices=IMAGE_KINDS, default=list(IMAGE_KINDS))
+    parser.add_argument('--source-size', type=int, nargs=2, default=[1600, 1200], metavar=('W', 'H'),
+                        help="size of the synthetic source images (default 1600 1200)")
+    parser.add_argument('--boards', nargs='+', default=['32x64', '128x128', '256x256'],
+                        help="board sizes as WIDTHxHEIGHT")
+    parser.add_argument('--palettes', nargs='+', default=['16', 'full', '1000'],
+                        help="palette sizes; 'full' is basic_colors as shipped")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--lut', action='store_true', help="use the cached lookup table where one exists")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    boards = [tuple(int(n) for n in board.lower().split('x')) for board in args.boards]
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for kind in args.images:
+            image_path = os.path.join(temp_dir, f"{kind}.png")
+            Image.fromarray(synthetic_image(kind, *args.source_size)).save(image_path)
+
+            for palette_size in args.palettes:
+                generator = BasicMosaicGenerator()
+                size = None if palette_size == 'full' else int(palette_size)
+                generator.basic_colors = palette_colors(generator, size)
+                if args.lut:
+                    generator.load_lookup_table(build=False)
+                palette_label = f"{palette_size} ({len(generator.palette)} colors)"
+
+                for width, height in boards:
+                    for row in run_case(generator, image_path, width, height, args.repeats):
+                        row = {'image': kind, 'board': f"{width}x{height}", 'palette': palette_label, **row}
+                        results.append(row)
+                        print(
+                            f"{kind:<9} {row['board']:>8} {palette_label:>18} {row['stage']:<9}"
+                            f"{row['seconds'] * 1000:>10.2f} ms {row['pixels_per_second'] or 0:>14,.0f} px/s"
+                            f"{row['peak_bytes'] / (1 << 20):>9.1f} MB"
+                        )
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'opencv': opencv() is not None,
+            'lut': args.lut,
+            'source_size': args.source_size,
+            'repeats': args.repeats,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            before = {case_key(row): row for row in json.load(f)['results']}
+        print(f"\nSpeedup against {args.compare} (>1 is faster now):")
+        for row in results:
+            old = before.get(case_key(row))
+            if old:
+                print(
+                    f"{row['image']:<9} {row['board']:>8} {row['palette']:>18} {row['stage']:<9}"
+                    f"{old['seconds'] / row['seconds']:>8.2f}x"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Merge same-color cells of a mosaic into larger plates.
+
+merge_bricks covers a Mosaic with plates of standard footprints, tried in
+order of preference (largest first by default), with 1x1 plates for
+whatever is left. For each footprint, and each orientation, candidate
+positions are taken on an h x w lattice, one lattice offset at a time.
+Blocks on one lattice cannot overlap, so a whole pass is a single NumPy
+step over the board. Passes are linear in the number of cells, and their
+count depends only on the footprints, not on the board size.
+"""
+import numpy as np
+
+from parts import PartsList
+from render import GRID_COLOR, SCALE_FACTOR, pack_rgb32, packed_image, render_packed
+
+# Plate footprints tried in this order; each is tried both ways round. 1x1 fills the rest.
+BRICK_SIZES = ('2x4', '2x3', '2x2', '1x4', '1x3', '1x2')
+
+# Marks cells already covered by a plate in the working copy of the indices
+_COVERED = np.iinfo(np.uint32).max
+
+# Stands in for "no stock limit" in the per-color counts
+_UNLIMITED = np.iinfo(np.int64).max
+
+
+def parse_size(name):
+    """(rows, columns) of a size name such as '2x4'."""
+    try:
+        rows, columns = (int(n) for n in name.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"Brick sizes look like '2x4', not {name!r}") from None
+    if rows < 1 or columns < 1:
+        raise ValueError(f"Brick sizes must be at least 1x1, not {name!r}")
+    return rows, columns
+
+
+def size_name(rows, columns):
+    """The size name of a footprint either way round, smaller side first."""
+    return f"{min(rows, columns)}x{max(rows, columns)}"
+
+
+def _stock_limits(stock, palette, size):
+    """Per-palette-entry counts and a shared count of ``size`` allowed by ``stock`` (None if unlimited).
+
+    ``stock`` maps a size name to a count shared by every color, and a color
+    name (any alias) to a dict of size name to count for that color.
+    """
+    if not stock:
+        return None, None
+    total = stock.get(size) if isinstance(stock.get(size), int) else None
+    per_color = np.full(len(palette), _UNLIMITED, dtype=np.int64)
+    limited = False
+    for index, aliases in enumerate(palette.aliases):
+        for alias in aliases:
+            counts = stock.get(alias)
+            if isinstance(counts, dict) and size in counts:
+                per_color[index] = counts[size]
+                limited = True
+                break
+    return (per_color if limited else None), total
+
+
+def _allowed(colors, per_color, total):
+    """Mask of the candidate plates stock allows, first come first served in raster order."""
+    keep = np.ones(len(colors), dtype=bool)
+    if per_color is not None:
+        order = np.argsort(colors, kind='stable')
+        ordered = colors[order]
+        # Position of each candidate among those of its own color
+        rank = np.arange(len(ordered)) - np.searchsorted(ordered, ordered)
+        keep[order] = rank < per_color[ordered]
+    if total is not None:
+        keep &= np.cumsum(keep) <= total
+    return keep
+
+
+def merge_bricks(mosaic, sizes=BRICK_SIZES, stock=None):
+    """Cover a Mosaic with the plates in ``sizes`` (in order of preference) and 1x1 plates.
+
+    ``stock`` optionally limits how many plates of a size may be used, either
+    for all colors ({'2x4': 500}) or per color ({'Red': {'2x4': 20}}).
+    Sizes without a limit are unlimited; 1x1 plates always are. Where stock
+    runs short, plates earlier in raster order are placed first.
+    """
+    height, width = mosaic.shape
+    work = mosaic.indices.astype(np.uint32)
+    rows, columns, heights, widths = [], [], [], []
+
+    for name in sizes:
+        size_rows, size_columns = parse_size(name)
+        name = size_name(size_rows, size_columns)
+        per_color, total = _stock_limits(stock, mosaic.palette, name)
+        # As given first, then turned 90 degrees
+        footprints = [(size_rows, size_columns)]
+        if size_rows != size_columns:
+            footprints.append((size_columns, size_rows))
+        for h, w in footprints:
+            for dy, dx in np.ndindex(h, w):
+                if total is not None and total <= 0:
+                    break
+                blocks_down = (height - dy) // h
+                blocks_across = (width - dx) // w
+                if not blocks_down or not blocks_across:
+                    continue
+                # (blocks down, h, blocks across, w) view of this lattice
+                blocks = work[dy:dy + blocks_down * h, dx:dx + blocks_across * w].reshape(
+                    blocks_down, h, blocks_across, w
+                )
+                corner = blocks[:, 0, :, 0]
+                fits = (blocks == corner[:, None, :, None]).all(axis=(1, 3)) & (corner != _COVERED)
+                block_y, block_x = np.nonzero(fits)
+                if not len(block_y):
+                    continue
+
+                colors = corner[block_y, block_x]
+                if per_color is not None or total is not None:
+                    keep = _allowed(colors, per_color, total)
+                    block_y, block_x, colors = block_y[keep], block_x[keep], colors[keep]
+                    if per_color is not None:
+                        per_color -= np.bincount(colors, minlength=len(per_color))
+                    if total is not None:
+                        total -= len(colors)
+                blocks[block_y, :, block_x, :] = _COVERED
+
+                rows.append(dy + block_y * h)
+                columns.append(dx + block_x * w)
+                heights.append(np.full(len(block_y), h))
+                widths.append(np.full(len(block_y), w))
+
+    # Whatever is left becomes 1x1 plates
+    single_y, single_x = np.nonzero(work != _COVERED)
+    rows.append(single_y)
+    columns.append(single_x)
+    heights.append(np.ones(len(single_y), dtype=int))
+    widths.append(np.ones(len(single_y), dtype=int))
+    return BrickLayout(
+        mosaic, np.concatenate(rows), np.concatenate(columns),
+        np.concatenate(heights), np.concatenate(widths),
+    )
+
+
+class BrickLayout:
+    """Plates covering a mosaic: the top-left cell, rows, columns and palette index of each.
+
+    Plates are in raster order of their top-left cell.
+    """
+
+    def __init__(self, mosaic, rows, columns, heights, widths):
+        order = np.argsort(np.asarray(rows) * mosaic.width + np.asarray(columns), kind='stable')
+        self.mosaic = mosaic
+        self.palette = mosaic.palette
+        self.rows = np.asarray(rows, dtype=np.int32)[order]
+        self.columns = np.asarray(columns, dtype=np.int32)[order]
+        self.heights = np.asarray(heights, dtype=np.int32)[order]
+        self.widths = np.asarray(widths, dtype=np.int32)[order]
+        self.colors = mosaic.indices[self.rows, self.columns]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __repr__(self):
+        return f"BrickLayout({self.mosaic.width}x{self.mosaic.height}, {len(self)} plates)"
+
+    def size_names(self):
+        """Size name ('1x2', '2x4', ...) of every plate."""
+        short = np.minimum(self.heights, self.widths)
+        long = np.maximum(self.heights, self.widths)
+        return [f"{a}x{b}" for a, b in zip(short.tolist(), long.tolist())]
+
+    def cell_bricks(self):
+        """(H, W) array numbering the plate that covers each cell."""
+        cells = np.empty(self.mosaic.shape, dtype=np.int32)
+        numbers = np.arange(len(self), dtype=np.int32)
+        footprints = np.unique(np.stack([self.heights, self.widths], axis=1), axis=0)
+        for h, w in footprints.tolist():
+            same = (self.heights == h) & (self.widths == w)
+            rows, columns, plates = self.rows[same], self.columns[same], numbers[same]
+            for dy in range(h):
+                for dx in range(w):
+                    cells[rows + dy, columns + dx] = plates
+        return cells
+
+    def parts_list(self, unit_costs=None, unit_weights=None):
+        """PartsList with one line per color and plate size (see PartsList.from_bricks)."""
+        return PartsList.from_bricks(self, unit_costs, unit_weights)
+
+    def render(self, scale_factor=SCALE_FACTOR, show_grid=True, show_studs=True, grid_color=GRID_COLOR):
+        """render_mosaic with grid lines only around plates, not between cells of one plate."""
+        mosaic = self.mosaic
+        pixels = render_packed(mosaic.indices, mosaic.palette.rgb, scale_factor, show_grid, show_studs,
+                               grid_color)
+        if not show_grid:
+            return packed_image(pixels)
+
+        # Each cell's grid is its top row and left column; clear them inside a plate
+        plates = self.cell_bricks()
+        same_above = np.zeros(mosaic.shape, dtype=bool)
+        same_above[1:] = plates[1:] == plates[:-1]
+        same_left = np.zeros(mosaic.shape, dtype=bool)
+        same_left[:, 1:] = plates[:, 1:] == plates[:, :-1]
+        fill = pack_rgb32(mosaic.to_rgb_array())
+
+        height, width = mosaic.shape
+        cells = pixels.reshape(height, scale_factor, width, scale_factor)
+        top = cells[:, 0, :, 1:]
+        top[same_above] = fill[same_above][:, None]
+        left = cells[:, 1:, :, 0].transpose(0, 2, 1)
+        left[same_left] = fill[same_left][:, None]
+        corner = cells[:, 0, :, 0]
+        inside = same_above & same_left
+        corner[inside] = fill[inside]
+        return packed_image(pixels)
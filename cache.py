@@ -0,0 +1,193 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _nbytes(value):
+    """Memory held by a cached value, as far as it can be measured."""
+    return getattr(value, 'nbytes', 0)
+
+
+class LRUCache:
+    """Dictionary-like cache that evicts the least recently used entries.
+
+    ``maxsize`` limits the number of entries and ``maxbytes`` the total of
+    ``sizeof(value)`` (array nbytes by default); either or both may be set.
+    ``hits``, ``misses`` and ``evictions`` count lookups since the last reset.
+    """
+
+    def __init__(self, maxsize=None, maxbytes=None, sizeof=_nbytes):
+        if maxsize is None and maxbytes is None:
+            raise ValueError("Cache needs an entry or byte limit")
+        if (maxsize is not None and maxsize <= 0) or (maxbytes is not None and maxbytes <= 0):
+            raise ValueError("Cache size must be a positive number")
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Return the cached value for key and mark it as recently used."""
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store a value, evicting the oldest entries beyond maxsize or maxbytes."""
+        if key in self._entries:
+            self.nbytes -= self._sizes[key]
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        self._sizes[key] = size
+        self.nbytes += size
+        while self._entries and (
+            (self.maxsize is not None and len(self._entries) > self.maxsize)
+            or (self.maxbytes is not None and self.nbytes > self.maxbytes)
+        ):
+            oldest, _ = self._entries.popitem(last=False)
+            self.nbytes -= self._sizes.pop(oldest)
+            self.evictions += 1
+
+    def clear(self):
+        """Drop all entries; the counters are kept."""
+        self._entries.clear()
+        self._sizes.clear()
+        self.nbytes = 0
+
+    def reset_stats(self):
+        """Zero the hit, miss and eviction counters."""
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """Return the counters and current fill as a dict."""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'nbytes': self.nbytes,
+            'maxbytes': self.maxbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class ImageCache:
+    """Two-level cache behind BasicMosaicGenerator.resize_image.
+
+    The first level holds decoded source images, keyed by path, modification
+    time and file size, so an edited file is decoded again. The second holds
+    crop-and-resize results, keyed by the source key plus the target size.
+    Each level is an LRUCache bounded in bytes. With ``disk_dir`` both levels
+    are also written there as .npy files, which are memory-mapped back in
+    after eviction or in a later process. Cached arrays are read-only.
+    Safe to share between threads.
+    """
+
+    def __init__(self, source_bytes=512 << 20, resized_bytes=64 << 20, disk_dir=None):
+        self.sources = LRUCache(maxbytes=source_bytes)
+        self.resized = LRUCache(maxbytes=resized_bytes)
+        self.disk_dir = disk_dir
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def source_key(path):
+        """(path, mtime, size) identifying one version of a file."""
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+    def get_source(self, path, load, reduction=1):
+        """Decoded image for path, calling load(path) on a miss.
+
+        ``reduction`` is the decode scale load uses; each scale is cached separately.
+        """
+        try:
+            key = self.source_key(path) + (reduction,)
+        except OSError:
+            # Let the loader report missing files the usual way
+            return load(path)
+        return self._get(self.sources, 'sources', key, lambda: load(path))
+
+    def get_resized(self, path, width, height, load, resize, reduction=1):
+        """resize(load(path), width, height), reusing cached sources and results.
+
+        Results are kept per ``reduction``, like the sources they come from.
+        """
+        try:
+            key = self.source_key(path) + (reduction, width, height)
+        except OSError:
+            return resize(load(path), width, height)
+        return self._get(
+            self.resized, 'resized', key,
+            lambda: resize(self.get_source(path, load, reduction), width, height),
+        )
+
+    def clear(self):
+        """Empty both memory levels; files in disk_dir are kept."""
+        with self._lock:
+            self.sources.clear()
+            self.resized.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'sources': self.sources.stats(), 'resized': self.resized.stats()}
+
+    def _get(self, level, level_name, key, compute):
+        with self._lock:
+            value = level.get(key)
+        if value is not None:
+            return value
+
+        value = self._disk_get(level_name, key)
+        if value is None:
+            value = np.asarray(compute())
+            value.flags.writeable = False
+            self._disk_put(level_name, key, value)
+        with self._lock:
+            level.put(key, value)
+        return value
+
+    def _disk_path(self, level_name, key):
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()[:32]
+        return os.path.join(self.disk_dir, level_name, digest + '.npy')
+
+    def _disk_get(self, level_name, key):
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(level_name, key)
+        if not os.path.exists(path):
+            return None
+        return np.load(path, mmap_mode='r')
+
+    def _disk_put(self, level_name, key, value):
+        if self.disk_dir is None:
+            return
+        path = self._disk_path(level_name, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.save(f, value)
+        os.replace(temp_path, path)
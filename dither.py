@@ -0,0 +1,136 @@
+import numpy as np
+
+from lut import pack_rgb
+
+
+# Error diffusion kernels: (dy, dx, weight) for each neighbour that receives part of a pixel's error
+DIFFUSION_KERNELS = {
+    'floyd-steinberg': (
+        (0, 1, 7 / 16),
+        (1, -1, 3 / 16), (1, 0, 5 / 16), (1, 1, 1 / 16),
+    ),
+    # Atkinson spreads only 6/8 of the error, which keeps contrast in flat areas
+    'atkinson': (
+        (0, 1, 1 / 8), (0, 2, 1 / 8),
+        (1, -1, 1 / 8), (1, 0, 1 / 8), (1, 1, 1 / 8),
+        (2, 0, 1 / 8),
+    ),
+}
+
+ORDERED_METHODS = ('bayer',)
+
+DITHER_METHODS = ('none',) + tuple(DIFFUSION_KERNELS) + ORDERED_METHODS
+
+# Side of the Bayer threshold matrix (a power of two)
+BAYER_SIZE = 4
+
+# Peak-to-peak amplitude of the ordered dither offsets, in 8-bit levels per channel
+ORDERED_SPREAD = 48
+
+
+class MatchMemo:
+    """Wraps a match function with a dense table of every 24-bit color answered so far.
+
+    Error diffusion matches a few hundred pixels at a time, so without a
+    lookup table the same colors would be searched for again and again.
+    """
+
+    def __init__(self, match):
+        self.match = match
+        self.table = np.full(1 << 24, -1, dtype=np.int32)
+
+    def __call__(self, colors):
+        colors = np.asarray(colors)
+        keys = pack_rgb(colors)
+        found = self.table[keys]
+        missing = found < 0
+        if missing.any():
+            new_keys, first = np.unique(keys[missing], return_index=True)
+            self.table[new_keys] = self.match(colors[missing][first])
+            found = self.table[keys]
+        return found
+
+
+def bayer_matrix(size=BAYER_SIZE):
+    """(size, size) Bayer threshold matrix with values spread evenly over [-0.5, 0.5)."""
+    if size < 1 or size & (size - 1):
+        raise ValueError("Bayer matrix size must be a power of two")
+    matrix = np.zeros((1, 1), dtype=np.int64)
+    while len(matrix) < size:
+        matrix = np.block([
+            [4 * matrix, 4 * matrix + 2],
+            [4 * matrix + 3, 4 * matrix + 1],
+        ])
+    return (matrix + 0.5) / matrix.size - 0.5
+
+
+def ordered_dither(rgb_image, match, size=BAYER_SIZE, spread=ORDERED_SPREAD, origin=(0, 0)):
+    """Palette indices for an (H, W, 3) RGB image with Bayer ordered dithering.
+
+    Each pixel is offset by its threshold before matching, all at once.
+    ``match`` maps an (H, W, 3) integer RGB array to palette indices.
+    ``origin`` is the (y, x) of the image's first pixel on the board, so
+    bands dithered separately line up.
+    """
+    rgb_image = np.asarray(rgb_image)
+    height, width = rgb_image.shape[:2]
+    thresholds = bayer_matrix(size) * spread
+    rows = (np.arange(height) + origin[0]) % size
+    columns = (np.arange(width) + origin[1]) % size
+    offsets = thresholds[rows[:, None], columns[None, :]]
+    dithered = np.rint(rgb_image + offsets[..., None])
+    return match(np.clip(dithered, 0, 255).astype(np.uint8))
+
+
+def error_diffusion(rgb_image, match, palette_rgb, kernel='floyd-steinberg', progress=None,
+                    progress_steps=50):
+    """Palette indices for an (H, W, 3) RGB image with error diffusion dithering.
+
+    Scans in raster order: each pixel is rounded, matched with ``match``
+    (which maps an (N, 3) integer RGB array to palette indices) and its
+    quantization error is passed to later neighbours.
+
+    Every kernel here only sends error to the right on the same row and to
+    rows below. Pixel (y, x) therefore waits only for pixels with a smaller
+    x + reach * y, where reach is the furthest left any kernel entry goes
+    plus one. All pixels on one such diagonal are processed together.
+
+    ``progress(rows_done, height)`` is called about ``progress_steps`` times;
+    an exception raised from it stops the scan.
+    """
+    weights = DIFFUSION_KERNELS[kernel]
+    rgb_image = np.asarray(rgb_image)
+    palette_rgb = np.asarray(palette_rgb, dtype=np.float32)
+    height, width = rgb_image.shape[:2]
+
+    pad_y = max(dy for dy, _, _ in weights)
+    pad_x = max(abs(dx) for _, dx, _ in weights)
+    reach = 1 + max(-dx for _, dx, _ in weights)
+
+    # Padding lets border pixels push error off the board without bounds checks
+    work = np.zeros((height + pad_y, width + 2 * pad_x, 3), dtype=np.float32)
+    work[:height, pad_x:pad_x + width] = rgb_image
+    indices = np.empty((height, width), dtype=np.intp)
+
+    all_rows = np.arange(height)
+    steps = width + reach * (height - 1)
+    report_every = max(1, steps // progress_steps)
+    for step in range(steps):
+        # Rows whose pixel on this diagonal lies inside the board
+        first = max(0, -(-(step - width + 1) // reach))
+        last = min(height - 1, step // reach)
+        ys = all_rows[first:last + 1]
+        xs = step - reach * ys
+
+        columns = xs + pad_x
+        values = work[ys, columns]
+        matched = match(np.clip(np.rint(values), 0, 255).astype(np.uint8))
+        indices[ys, xs] = matched
+        error = values - palette_rgb[matched]
+        for dy, dx, weight in weights:
+            work[ys + dy, columns + dx] += error * weight
+
+        if progress is not None and (step % report_every == 0 or step == steps - 1):
+            # A row is finished once its last pixel's diagonal has been processed
+            progress(min(height, max(0, (step - width + 1) // reach + 1)), height)
+    return indices
@@ -0,0 +1,106 @@
+"""Saving rendered mosaics: indexed or RGB PNG, lossless WebP and raw palette indices.
+
+A rendered board has at most a few hundred distinct colors (a fill and a stud
+shade per palette entry used, plus the grid), so PNG, TIFF and BMP output is
+written as a palette ('P') image drawn straight from the index grid whenever
+256 colors suffice; it decodes to the same pixels as the RGB render. .npz
+output skips rendering and writes the index grid and its palette with
+Mosaic.save; load_indices (or Mosaic.load) reads it back.
+"""
+import os
+
+from instrument import NULL_INSTRUMENTATION
+from mosaic import Mosaic
+from render import GRID_COLOR, SCALE_FACTOR, render_indices, render_paletted
+from tiles import COMPRESS_LEVEL
+
+# File format for each output extension; 'NPZ' is the raw index grid
+OUTPUT_FORMATS = {
+    '.png': 'PNG', '.webp': 'WEBP', '.npz': 'NPZ', '.jpg': 'JPEG', '.jpeg': 'JPEG',
+    '.bmp': 'BMP', '.tif': 'TIFF', '.tiff': 'TIFF',
+}
+
+# Formats that can store a palette image as it is
+INDEXED_FORMATS = ('PNG', 'BMP', 'TIFF')
+
+# zlib level used by fast mode: much quicker than the default for somewhat larger files
+FAST_COMPRESS_LEVEL = 1
+
+# Lossless WebP effort as (method, quality): Pillow's defaults, and the quickest setting
+WEBP_EFFORT = (4, 80)
+WEBP_FAST_EFFORT = (0, 0)
+
+# Largest width or height WebP can store
+WEBP_MAX_SIDE = 16383
+
+
+def output_format(path):
+    """File format for an output path, from its extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Unsupported output format: {extension or path} "
+            f"(use {', '.join(sorted(OUTPUT_FORMATS))})"
+        )
+    return OUTPUT_FORMATS[extension]
+
+
+def render_output(mosaic, scale_factor=SCALE_FACTOR, show_grid=True, show_studs=True,
+                  grid_color=GRID_COLOR, indexed=True):
+    """Render a Mosaic as a 'P' image when ``indexed`` and 256 colors suffice, else as RGB."""
+    if indexed:
+        image = render_paletted(mosaic.indices, mosaic.palette.rgb, scale_factor, show_grid, show_studs,
+                                grid_color)
+        if image is not None:
+            return image
+    return render_indices(mosaic.indices, mosaic.palette.rgb, scale_factor, show_grid, show_studs, grid_color)
+
+
+def save_image(image, fp, file_format, compress_level=None, fast=False):
+    """Save a rendered image to a path or file object with the options for ``file_format``.
+
+    ``compress_level`` (0-9) applies to PNG; ``fast`` trades file size for
+    encoding speed in PNG and WebP.
+    """
+    if file_format == 'PNG':
+        if compress_level is None:
+            compress_level = FAST_COMPRESS_LEVEL if fast else COMPRESS_LEVEL
+        image.save(fp, 'PNG', compress_level=compress_level)
+    elif file_format == 'WEBP':
+        if max(image.size) > WEBP_MAX_SIDE:
+            raise ValueError(f"WebP images are at most {WEBP_MAX_SIDE} pixels on a side; save a PNG instead")
+        method, quality = WEBP_FAST_EFFORT if fast else WEBP_EFFORT
+        image.convert('RGB').save(fp, 'WEBP', lossless=True, method=method, quality=quality)
+    elif file_format in INDEXED_FORMATS:
+        image.save(fp, file_format)
+    else:
+        image.convert('RGB').save(fp, file_format)
+
+
+def load_indices(fp):
+    """Mosaic saved as .npz by save_mosaic or Mosaic.save."""
+    return Mosaic.load(fp)
+
+
+def save_mosaic(mosaic, fp, scale_factor=SCALE_FACTOR, show_grid=True, show_studs=True,
+                grid_color=GRID_COLOR, indexed=True, compress_level=None, fast=False, file_format=None,
+                instrumentation=NULL_INSTRUMENTATION):
+    """Render and save a Mosaic in the format chosen by the path's extension (or ``file_format``).
+
+    ``indexed`` writes palette images where the format allows; see
+    save_image for ``compress_level`` and ``fast``. Rendering and encoding
+    are timed as the 'render' and 'encode' stages of ``instrumentation``.
+    """
+    file_format = file_format or output_format(fp)
+    if file_format == 'NPZ':
+        with instrumentation.stage('encode'):
+            mosaic.save(fp, fast)
+        return
+
+    with instrumentation.stage('render'):
+        image = render_output(
+            mosaic, scale_factor, show_grid, show_studs, grid_color,
+            indexed and file_format in INDEXED_FORMATS,
+        )
+    with instrumentation.stage('encode'):
+        save_image(image, fp, file_format, compress_level, fast)
@@ -1,11 +1,112 @@
-import cv2
 import numpy as np
-from PIL import Image, ImageDraw
+from PIL import Image
 import os
-from sklearn.cluster import KMeans
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from multiprocessing import shared_memory
+
+# OpenCV and scikit-learn are imported on first use (see imaging.opencv and fit_palette)
+from cache import ImageCache, LRUCache
+from dither import DIFFUSION_KERNELS, MatchMemo, error_diffusion, ordered_dither
+from imaging import bgr_to_rgb, read_image, resize_area
+from instrument import NULL_INSTRUMENTATION
+from lut import load_lut, pack_rgb
+from mosaic import Mosaic, index_dtype
+from parts import PartsList
+from tiles import area_resize_band, band_rows
+from palette import SPATIAL_INDEX_THRESHOLD, CompiledPalette, rgb_to_lab_array
+
+# Image file types resize_image can read; .npy holds an (H, W, 3) BGR array, memory-mapped
+SUPPORTED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp', '.tif', '.tiff', '.npy')
+
+# JPEG files can be decoded at 1/2, 1/4 or 1/8 scale by libjpeg itself
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+REDUCED_DECODE_SCALES = (8, 4, 2)
+
+# Source pixels a reduced decode keeps per mosaic cell in each direction, so INTER_AREA
+# still averages a block of pixels for every cell
+REDUCED_DECODE_MARGIN = 4
+
+# EXIF orientations that swap width and height (cv2.imread applies the rotation)
+EXIF_ORIENTATION_TAG = 0x0112
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+# Number of pixels matched against the palette at once in match_colors
+MATCH_CHUNK_SIZE = 2048
+
+# Row bands handed to each worker process by match_colors_parallel, for load balancing
+BANDS_PER_WORKER = 4
+
+# Pixels sampled from the resized image to fit a reduced palette
+PALETTE_SAMPLE_SIZE = 8192
+
+# Reduced palettes remembered per (image version, size, color count)
+PALETTE_CACHE_SIZE = 32
+
+# Number of progress updates generate_mosaic aims for when given a progress callback
+PROGRESS_STEPS = 50
+
+
+class MosaicCancelled(Exception):
+    """Raised by a progress callback to stop generate_mosaic early."""
+
+
+def _unique_colors(rgb_image):
+    """Distinct colors of an RGB array as (packed keys, (N, 3) colors, inverse index)."""
+    keys = pack_rgb(rgb_image).reshape(-1)
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    unique_colors = np.stack(
+        [unique_keys >> 16, (unique_keys >> 8) & 0xFF, unique_keys & 0xFF], axis=-1
+    )
+    return unique_keys, unique_colors, inverse.reshape(-1)
+
+
+def _match_unique(palette, colors, chunk_size):
+    """Match an (N, 3) array of colors against the palette in chunks."""
+    indices = np.empty(len(colors), dtype=np.intp)
+    for start in range(0, len(colors), chunk_size):
+        indices[start:start + chunk_size] = palette.nearest(colors[start:start + chunk_size])
+    return indices
+
+
+def _match_band(palette, image_name, indices_name, shape, start, stop, chunk_size):
+    """Worker process: match rows [start, stop) of a shared RGB image into the shared index array."""
+    image_memory = shared_memory.SharedMemory(name=image_name)
+    indices_memory = shared_memory.SharedMemory(name=indices_name)
+    try:
+        image = np.ndarray(shape, dtype=np.uint8, buffer=image_memory.buf)
+        indices = np.ndarray(shape[:2], dtype=np.intp, buffer=indices_memory.buf)
+        _, unique_colors, inverse = _unique_colors(image[start:stop])
+        band = _match_unique(palette, unique_colors, chunk_size)[inverse]
+        indices[start:stop] = band.reshape(stop - start, shape[1])
+        del image, indices
+    finally:
+        image_memory.close()
+        indices_memory.close()
+
 
 class BasicMosaicGenerator:
-    def __init__(self):
+    def __init__(self, color_cache_size=None, image_cache=None, reduced_decode=True, instrumentation=None,
+                 metric='blend', prefilter=None):
+        # Matching distance (see metrics.METRICS) and optional CIE76 prefilter size for the palette
+        self.metric = metric
+        self.prefilter = prefilter
+        
+        # Optional LRU memo of pixel color -> palette index, shared by all matching paths
+        self.color_cache = LRUCache(color_cache_size) if color_cache_size else None
+        
+        # Optional ImageCache of decoded and resized images used by resize_image
+        self.image_cache = image_cache
+        
+        # Let large JPEGs be decoded at a fraction of their size when the mosaic is small
+        self.reduced_decode = reduced_decode
+        
+        # Reduced palettes fitted by reduced_palette, keyed by image version and size
+        self.palette_cache = LRUCache(PALETTE_CACHE_SIZE)
+        
+        # Stage timers and counters (see instrument.Instrumentation); the default records nothing
+        self.instrumentation = instrumentation or NULL_INSTRUMENTATION
+        
         # Ultra-comprehensive color palette for maximum accuracy
         self.basic_colors = {
             # Pure colors
@@ -292,74 +393,51 @@ class BasicMosaicGenerator:
             if len(color) == 3:  # Skip transparent colors for now
                 self.basic_colors_bgr[name] = (color[2], color[1], color[0])
     
+    @property
+    def palette(self):
+        """Compiled form of basic_colors, rebuilt whenever basic_colors, metric or prefilter changes."""
+        key = (tuple(self.basic_colors.items()), self.metric, self.prefilter)
+        if getattr(self, '_palette_key', None) != key:
+            self._palette = CompiledPalette(self.basic_colors, self.metric, self.prefilter)
+            self._palette_key = key
+            
+            # Cached matches refer to the previous palette
+            if self.color_cache is not None:
+                self.color_cache.clear()
+        return self._palette
+    
     def find_closest_color(self, pixel_color):
         """Find the closest color from the palette using improved distance calculation."""
-        min_distance = float('inf')
-        closest_color = None
-        
-        # Convert pixel to LAB for better perceptual distance calculation
-        pixel_lab = self.rgb_to_lab(pixel_color)
+        palette = self.palette
+        if self.color_cache is None:
+            index = palette.nearest(np.array([pixel_color[:3]]))[0]
+            return palette.colors[index]
         
-        # Determine if pixel is greenish
-        r, g, b = pixel_color
-        is_greenish = g > max(r, b) * 1.2  # Green component is significantly higher
-        is_orangeish = r > g * 1.3 and g > b * 1.2  # Red dominant, green secondary, blue low
-        
-        for color_name, palette_color in self.basic_colors.items():
-            # Convert palette color to LAB
-            palette_lab = self.rgb_to_lab(palette_color)
-            
-            # Calculate weighted distance using both RGB and LAB
-            rgb_distance = self.calculate_rgb_distance(pixel_color, palette_color)
-            lab_distance = self.calculate_lab_distance(pixel_lab, palette_lab)
-            
-            # Weighted combination: LAB for perceptual accuracy, RGB for precision
-            total_distance = (0.7 * lab_distance) + (0.3 * rgb_distance)
-            
-            # Bonus for green colors if pixel is greenish
-            if is_greenish and self.is_green_color(palette_color):
-                total_distance *= 0.7  # 30% bonus for green colors
-            
-            # Bonus for orange colors if pixel is orangeish
-            if is_orangeish and self.is_orange_color(palette_color):
-                total_distance *= 0.7  # 30% bonus for orange colors
-            
-            if total_distance < min_distance:
-                min_distance = total_distance
-                closest_color = palette_color
-                
-        return closest_color
+        key = int(pack_rgb(pixel_color[:3]))
+        index = self.color_cache.get(key)
+        if index is None:
+            index = int(palette.nearest(np.array([pixel_color[:3]]))[0])
+            self.color_cache.put(key, index)
+        return palette.colors[index]
     
     def is_green_color(self, color):
         """Check if a color is in the green family"""
-        r, g, b = color
-        # Check if it's a green variant (olive, yellow-green, sage, etc.)
-        green_variants = [
-            'Green', 'Olive', 'Yellow_Green', 'Sage', 'Forest_Green', 'Spring_Green'
-        ]
-        
-        # Check by name first
-        for name, palette_color in self.basic_colors.items():
-            if palette_color == color:
-                return any(variant in name for variant in green_variants)
+        index = self.palette.index_of(color)
+        if index is not None:
+            return bool(self.palette.is_green[index])
         
         # Fallback: check if green component is dominant
+        r, g, b = color
         return g > max(r, b) * 1.1
     
     def is_orange_color(self, color):
         """Check if a color is in the orange family"""
-        r, g, b = color
-        # Check if it's an orange variant (cat orange, ginger, warm orange, etc.)
-        orange_variants = [
-            'Orange', 'Cat_Orange', 'Ginger', 'Warm_Orange', 'Orange_Red', 'Coral', 'Salmon'
-        ]
-        
-        # Check by name first
-        for name, palette_color in self.basic_colors.items():
-            if palette_color == color:
-                return any(variant in name for variant in orange_variants)
+        index = self.palette.index_of(color)
+        if index is not None:
+            return bool(self.palette.is_orange[index])
         
         # Fallback: check if it's orange-like (red dominant, green secondary, blue low)
+        r, g, b = color
         return r > g * 1.2 and g > b * 1.1
     
     def rgb_to_lab(self, rgb_color):
@@ -435,11 +513,14 @@ class BasicMosaicGenerator:
         return (0.6 * brightness_diff) + (0.4 * color_diff)
     
     def calculate_lab_distance(self, lab1, lab2):
-        """Calculate CIEDE2000-like distance in LAB space."""
+        """Euclidean LAB distance with lightness counted twice (the 'blend' model's LAB term).
+        
+        Not CIEDE2000; set ``metric`` to 'ciede2000' to match with that (see metrics.py).
+        """
         l1, a1, b1 = lab1
         l2, a2, b2 = lab2
         
-        # Simplified CIEDE2000 distance calculation
+        # Lightness-weighted Euclidean distance
         delta_l = l2 - l1
         delta_a = a2 - a1
         delta_b = b2 - b1
@@ -447,25 +528,62 @@ class BasicMosaicGenerator:
         # Weight L (lightness) more heavily for perceptual accuracy
         return ((delta_l * 2) ** 2 + delta_a ** 2 + delta_b ** 2) ** 0.5
     
-    def resize_image(self, image_path, width, height):
-        """Resize image to target dimensions while preserving aspect ratio and filling the target size"""
+    def load_image(self, image_path, reduction=1):
+        """Read an image file as a 3-channel BGR array, JPEGs optionally at 1/reduction scale."""
         # Read image
-        if image_path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-            img = cv2.imread(image_path)
+        if image_path.lower().endswith('.npy'):
+            img = np.load(image_path, mmap_mode='r')
+            if img.ndim != 3 or img.shape[2] != 3 or img.dtype != np.uint8:
+                raise ValueError("Expected an (H, W, 3) uint8 BGR array")
+        elif image_path.lower().endswith(SUPPORTED_EXTENSIONS):
+            # OpenCV when installed, Pillow otherwise; always 3-channel BGR
+            with self.instrumentation.stage('decode'):
+                img = read_image(image_path, reduction)
             if img is None:
                 raise ValueError("Could not read the image file")
         else:
             raise ValueError("Unsupported image format")
+        return img
+    
+    def decode_reduction(self, image_path, width, height):
+        """Largest JPEG decode scale (1, 2, 4 or 8) that keeps REDUCED_DECODE_MARGIN pixels per cell.
         
-        # Check if image is grayscale and convert to RGB if needed
-        if len(img.shape) == 2:  # Grayscale image
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-        elif img.shape[2] == 4:  # RGBA image
-            img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-        
-        # Get original dimensions
-        orig_height, orig_width = img.shape[:2]
+        Only the file header is read, to get the image size.
+        """
+        if not self.reduced_decode or not image_path.lower().endswith(JPEG_EXTENSIONS):
+            return 1
+        try:
+            with Image.open(image_path) as img:
+                orig_width, orig_height = img.size
+                if img.getexif().get(EXIF_ORIENTATION_TAG) in TRANSPOSED_ORIENTATIONS:
+                    orig_width, orig_height = orig_height, orig_width
+        except (OSError, ValueError):
+            # Leave unreadable files to load_image to report
+            return 1
         
+        _, _, crop_width, crop_height = self.crop_box(orig_width, orig_height, width, height)
+        for reduction in REDUCED_DECODE_SCALES:
+            if (crop_width // reduction >= REDUCED_DECODE_MARGIN * width
+                    and crop_height // reduction >= REDUCED_DECODE_MARGIN * height):
+                return reduction
+        return 1
+    
+    def resize_image(self, image_path, width, height):
+        """Resize image to target dimensions while preserving aspect ratio and filling the target size"""
+        reduction = self.decode_reduction(image_path, width, height)
+        load = partial(self.load_image, reduction=reduction)
+        if self.image_cache is None:
+            return self.crop_and_resize(load(image_path), width, height)
+        misses = self.image_cache.resized.misses
+        resized = self.image_cache.get_resized(
+            image_path, width, height, load, self.crop_and_resize, reduction
+        )
+        hit = self.image_cache.resized.misses == misses
+        self.instrumentation.count('image_cache_hits' if hit else 'image_cache_misses')
+        return resized
+    
+    def crop_box(self, orig_width, orig_height, width, height):
+        """(x, y, width, height) of the centered region with the target aspect ratio."""
         # Calculate aspect ratios
         target_aspect = width / height
         orig_aspect = orig_width / orig_height
@@ -483,39 +601,345 @@ class BasicMosaicGenerator:
             new_height = int(orig_width / target_aspect)
             start_x = 0
             start_y = (orig_height - new_height) // 2
+        return start_x, start_y, new_width, new_height
+    
+    def crop_and_resize(self, img, width, height):
+        """Center-crop a decoded image to the target aspect ratio and resize it with INTER_AREA."""
+        # Get original dimensions
+        orig_height, orig_width = img.shape[:2]
+        start_x, start_y, new_width, new_height = self.crop_box(orig_width, orig_height, width, height)
         
         # Crop image to match target aspect ratio
         cropped = img[start_y:start_y + new_height, start_x:start_x + new_width]
         
         # Resize to target dimensions
-        resized = cv2.resize(cropped, (width, height), interpolation=cv2.INTER_AREA)
+        with self.instrumentation.stage('resize'):
+            resized = resize_area(cropped, width, height)
         return resized
     
-    def generate_mosaic(self, image_path, width, height):
-        """Generate a mosaic from the given image"""
-        # Resize and crop image to target dimensions
-        resized_image = self.resize_image(image_path, width, height)
-        
-        # Convert BGR to RGB (OpenCV uses BGR, we need RGB)
-        resized_image = cv2.cvtColor(resized_image, cv2.COLOR_BGR2RGB)
-        
-        # Create mosaic array
-        mosaic = []
-        
-        for y in range(height):
-            row = []
-            for x in range(width):
-                # Get pixel color (OpenCV array is [y, x, channels])
-                pixel_color = tuple(resized_image[y, x])
-                
-                # Find closest color from palette
-                closest_color = self.find_closest_color(pixel_color)
-                
-                # Add to row
-                row.append(closest_color)
-            mosaic.append(row)
-        
-        return mosaic
+    def get_palette_array(self):
+        """Return the deduplicated palette as an (N, 3) uint8 array."""
+        return self.palette.rgb
+    
+    def rgb_to_lab_array(self, rgb_array):
+        """Vectorized rgb_to_lab for an (..., 3) array of 8-bit RGB values."""
+        return rgb_to_lab_array(rgb_array)
+    
+    def match_colors(self, rgb_image, chunk_size=MATCH_CHUNK_SIZE, palette=None):
+        """Match every pixel of an (H, W, 3) RGB image against the palette at once.
+        
+        Applies the same distance model as find_closest_color (0.7 LAB / 0.3 RGB
+        blend plus the green and orange bonuses) and returns an (H, W) array of
+        indices into get_palette_array(). Uses the lookup table when one has
+        been loaded with load_lookup_table().
+        
+        Another CompiledPalette, such as one from reduced_palette, can be
+        matched against instead; the indices then refer to it, and neither
+        the lookup table nor the color cache is used.
+        """
+        rgb_image = np.asarray(rgb_image)
+        if rgb_image.ndim < 1 or rgb_image.shape[-1] != 3:
+            raise ValueError("Expected an array of RGB pixels")
+        
+        # A loaded lookup table answers every pixel with a single indexing step
+        own_palette = palette is None or palette is self.palette
+        palette = self.palette if palette is None else palette
+        instrumentation = self.instrumentation
+        instrumentation.count('pixels_matched', rgb_image.size // 3)
+        if own_palette and getattr(self, '_lut_palette', None) is palette:
+            instrumentation.count('lut_lookups', rgb_image.size // 3)
+            return self._lut[pack_rgb(rgb_image)]
+        
+        # Match each distinct color only once
+        unique_keys, unique_colors, inverse = _unique_colors(rgb_image)
+        instrumentation.count('unique_colors', len(unique_keys))
+        if self.color_cache is None or not own_palette:
+            self._count_searches(palette, len(unique_colors))
+            unique_indices = _match_unique(palette, unique_colors, chunk_size)
+        else:
+            unique_indices = self._match_unique_cached(palette, unique_keys, unique_colors, chunk_size)
+        
+        return unique_indices[inverse].reshape(rgb_image.shape[:-1])
+    
+    def _match_unique_cached(self, palette, keys, colors, chunk_size):
+        """Like _match_unique, but answers known colors from color_cache and stores the rest."""
+        cache = self.color_cache
+        indices = np.empty(len(colors), dtype=np.intp)
+        missing = []
+        for position, key in enumerate(keys.tolist()):
+            index = cache.get(key)
+            if index is None:
+                missing.append(position)
+            else:
+                indices[position] = index
+        
+        self.instrumentation.count('color_cache_hits', len(colors) - len(missing))
+        self.instrumentation.count('color_cache_misses', len(missing))
+        if missing:
+            self._count_searches(palette, len(missing))
+            matched = _match_unique(palette, colors[missing], chunk_size)
+            indices[missing] = matched
+            for key, index in zip(keys[missing].tolist(), matched.tolist()):
+                cache.put(key, index)
+        return indices
+    
+    def _count_searches(self, palette, colors):
+        """Record palette searches: full-scan distance evaluations, or k-d tree queries for big palettes."""
+        if len(palette) > SPATIAL_INDEX_THRESHOLD:
+            self.instrumentation.count('index_searches', colors)
+        else:
+            self.instrumentation.count('palette_comparisons', colors * len(palette))
+    
+    def match_colors_parallel(self, rgb_image, workers=None, chunk_size=MATCH_CHUNK_SIZE, progress=None):
+        """match_colors spread over a pool of ``workers`` processes (all CPUs by default).
+        
+        The image is split into row bands. Workers read the image from and write
+        their indices into shared memory, so neither is pickled. The result is
+        identical to match_colors. The color cache is not consulted, and a loaded
+        lookup table is used in this process instead. ``progress(rows_done,
+        total_rows)`` is called as bands finish; if it raises, bands that have
+        not started are cancelled and the exception propagates.
+        """
+        rgb_image = np.ascontiguousarray(rgb_image, dtype=np.uint8)
+        if rgb_image.ndim != 3 or rgb_image.shape[-1] != 3:
+            raise ValueError("Expected an (H, W, 3) RGB image")
+        
+        workers = workers or os.cpu_count() or 1
+        palette = self.palette
+        height = rgb_image.shape[0]
+        if workers == 1 or height < 2 or getattr(self, '_lut_palette', None) is palette:
+            return self._match_rows(rgb_image, chunk_size, progress)
+        
+        band_rows = -(-height // (workers * BANDS_PER_WORKER))
+        # Workers do not report counters back; record what is known here
+        self.instrumentation.count('pixels_matched', height * rgb_image.shape[1])
+        image_memory = shared_memory.SharedMemory(create=True, size=rgb_image.nbytes)
+        indices_memory = shared_memory.SharedMemory(
+            create=True, size=max(1, height * rgb_image.shape[1] * np.dtype(np.intp).itemsize)
+        )
+        try:
+            image = np.ndarray(rgb_image.shape, dtype=np.uint8, buffer=image_memory.buf)
+            image[:] = rgb_image
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(
+                        _match_band, palette, image_memory.name, indices_memory.name,
+                        rgb_image.shape, start, min(start + band_rows, height), chunk_size,
+                    ): min(start + band_rows, height) - start
+                    for start in range(0, height, band_rows)
+                }
+                rows_done = 0
+                try:
+                    for future in as_completed(futures):
+                        future.result()
+                        rows_done += futures[future]
+                        if progress is not None:
+                            progress(rows_done, height)
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+            indices = np.ndarray(rgb_image.shape[:2], dtype=np.intp, buffer=indices_memory.buf).copy()
+            del image
+        finally:
+            image_memory.close()
+            image_memory.unlink()
+            indices_memory.close()
+            indices_memory.unlink()
+        return indices
+    
+    def _match_rows(self, rgb_image, chunk_size=MATCH_CHUNK_SIZE, progress=None, palette=None):
+        """match_colors on an (H, W, 3) image in row bands, calling progress(rows_done, total_rows)."""
+        if progress is None:
+            return self.match_colors(rgb_image, chunk_size, palette)
+        
+        height = rgb_image.shape[0]
+        indices = np.empty(rgb_image.shape[:2], dtype=np.intp)
+        band_rows = max(1, -(-height // PROGRESS_STEPS))
+        for start in range(0, height, band_rows):
+            stop = min(start + band_rows, height)
+            indices[start:stop] = self.match_colors(rgb_image[start:stop], chunk_size, palette)
+            progress(stop, height)
+        return indices
+    
+    def load_lookup_table(self, cache_dir=None, build=True, workers=None):
+        """Use a precomputed 24-bit RGB -> palette lookup table in match_colors.
+        
+        The table is memory-mapped from the on-disk cache, keyed by the palette
+        and distance model. If it is missing it is built with ``workers``
+        processes, unless ``build`` is false. Returns True if a table is in use.
+        """
+        palette = self.palette
+        lut = load_lut(palette, cache_dir=cache_dir, build=build, workers=workers)
+        self._lut = lut
+        self._lut_palette = palette if lut is not None else None
+        return lut is not None
+    
+    def fit_palette(self, rgb_image, n_colors, sample_size=PALETTE_SAMPLE_SIZE, seed=0):
+        """Choose at most ``n_colors`` palette entries that best cover an RGB image.
+        
+        Clusters a random sample of the pixels with MiniBatchKMeans and snaps
+        each cluster center to its closest palette color. Centers that snap to
+        the same color leave room for the colors the sample uses most.
+        Returns the chosen entries as a CompiledPalette in palette order.
+        """
+        # scikit-learn takes about a second to import, so only palette reduction pays for it
+        from sklearn.cluster import MiniBatchKMeans
+        
+        palette = self.palette
+        pixels = np.asarray(rgb_image).reshape(-1, 3)
+        rng = np.random.default_rng(seed)
+        if len(pixels) > sample_size:
+            pixels = pixels[rng.choice(len(pixels), sample_size, replace=False)]
+        n_colors = min(n_colors, len(palette))
+        
+        # KMeans cannot find more clusters than there are distinct colors
+        clusters = min(n_colors, len(np.unique(pack_rgb(pixels))))
+        kmeans = MiniBatchKMeans(n_clusters=clusters, n_init=3, random_state=seed)
+        labels = kmeans.fit_predict(pixels.astype(np.float32))
+        
+        # Biggest clusters pick their color first
+        centers = np.clip(np.rint(kmeans.cluster_centers_), 0, 255)
+        snapped = palette.nearest(centers)
+        order = np.argsort(-np.bincount(labels, minlength=clusters), kind='stable')
+        chosen = list(dict.fromkeys(snapped[order].tolist()))
+        
+        if len(chosen) < n_colors:
+            usage = np.bincount(palette.nearest(pixels), minlength=len(palette))
+            for index in np.argsort(-usage, kind='stable').tolist():
+                if len(chosen) == n_colors or usage[index] == 0:
+                    break
+                if index not in chosen:
+                    chosen.append(index)
+        return palette.subset(sorted(chosen))
+    
+    def reduced_palette(self, rgb_image, n_colors, image_path=None):
+        """fit_palette, remembered in palette_cache per image file version, board size and color count."""
+        try:
+            key = (ImageCache.source_key(image_path), rgb_image.shape[:2], n_colors, self.palette.fingerprint())
+        except (OSError, TypeError):
+            return self.fit_palette(rgb_image, n_colors)
+        palette = self.palette_cache.get(key)
+        if palette is None:
+            palette = self.fit_palette(rgb_image, n_colors)
+            self.palette_cache.put(key, palette)
+        return palette
+    
+    def dither_colors(self, rgb_image, method, progress=None, palette=None):
+        """Palette indices for an (H, W, 3) RGB image using a dither.DITHER_METHODS method.
+        
+        Error diffusion ('floyd-steinberg', 'atkinson') runs in raster order and
+        is much faster with a lookup table loaded; 'bayer' is ordered
+        dithering, matched in one batch. All use the match_colors distance
+        model, against ``palette`` if given.
+        """
+        palette = self.palette if palette is None else palette
+        match = partial(self.match_colors, palette=palette)
+        if method in DIFFUSION_KERNELS:
+            if getattr(self, '_lut_palette', None) is not palette:
+                match = MatchMemo(match)
+            return error_diffusion(rgb_image, match, palette.rgb, method, progress)
+        if method == 'bayer':
+            indices = ordered_dither(rgb_image, match)
+            if progress is not None:
+                progress(len(indices), len(indices))
+            return indices
+        raise ValueError(f"Unknown dithering method: {method}")
+    
+    def generate_mosaic(self, image_path, width, height, workers=1, progress=None, dither=None,
+                        max_colors=None):
+        """Generate a Mosaic from the given image
+        
+        With ``workers`` other than 1, matching runs in a process pool
+        (see match_colors_parallel); None uses every CPU. ``progress`` is called
+        as progress(rows_done, height) while rows are matched; raising
+        MosaicCancelled (or any exception) from it aborts generation.
+        ``dither`` selects a dithering method (see dither_colors); None or
+        'none' matches every cell to its nearest color. ``max_colors`` limits
+        the board to that many palette colors chosen for this image (see
+        reduced_palette).
+        """
+        instrumentation = self.instrumentation
+        with instrumentation.profiling():
+            # Resize and crop image to target dimensions
+            resized_image = self.resize_image(image_path, width, height)
+            
+            # Convert BGR to RGB (OpenCV uses BGR, we need RGB)
+            with instrumentation.stage('convert'):
+                resized_image = bgr_to_rgb(resized_image)
+            
+            palette = self.palette
+            if max_colors:
+                with instrumentation.stage('fit_palette'):
+                    palette = self.reduced_palette(resized_image, max_colors, image_path)
+            
+            # Match all pixels against the palette in one batch
+            if dither not in (None, 'none'):
+                with instrumentation.stage('dither'):
+                    indices = self.dither_colors(resized_image, dither, progress, palette)
+            else:
+                with instrumentation.stage('match'):
+                    if palette is not self.palette:
+                        # Reduced palettes are small; a process pool would not pay off
+                        indices = self._match_rows(resized_image, progress=progress, palette=palette)
+                    elif workers == 1:
+                        indices = self._match_rows(resized_image, progress=progress)
+                    else:
+                        indices = self.match_colors_parallel(resized_image, workers, progress=progress)
+            
+            # Compact index grid; still indexable as mosaic[y][x] -> RGB tuple
+            return Mosaic(indices, palette)
+    
+    def generate_mosaic_striped(self, image_path, width, height, progress=None, dither=None):
+        """generate_mosaic for huge sources and boards, one band of mosaic rows at a time.
+        
+        Each band is area-resampled straight from the decoded source (which is
+        memory-mapped for .npy files, or through an ImageCache with a disk
+        directory) and matched before the next is read. No cropped copy and
+        no full-size float image are made, so apart from the decode, working
+        memory stays near tiles.STRIP_BYTES. Colors can differ from
+        generate_mosaic by one level per channel before matching. Of the
+        dithering methods only 'bayer' works band by band.
+        """
+        if dither not in (None, 'none', 'bayer'):
+            raise ValueError("Only ordered ('bayer') dithering can be used on striped mosaics")
+        
+        reduction = self.decode_reduction(image_path, width, height)
+        load = partial(self.load_image, reduction=reduction)
+        if self.image_cache is None:
+            source = load(image_path)
+        else:
+            source = self.image_cache.get_source(image_path, load, reduction)
+        
+        orig_height, orig_width = source.shape[:2]
+        box = self.crop_box(orig_width, orig_height, width, height)
+        # float64 cumulative sums of a band's source rows dominate its memory
+        rows = band_rows(box[3] / height * box[2] * 3 * 8 * 2)
+        
+        indices = np.empty((height, width), dtype=index_dtype(self.palette))
+        for start in range(0, height, rows):
+            stop = min(start + rows, height)
+            with self.instrumentation.stage('resize'):
+                band = area_resize_band(source, box, width, height, start, stop)
+            # BGR to RGB
+            if dither == 'bayer':
+                with self.instrumentation.stage('dither'):
+                    indices[start:stop] = ordered_dither(band[..., ::-1], self.match_colors, origin=(start, 0))
+            else:
+                with self.instrumentation.stage('match'):
+                    indices[start:stop] = self.match_colors(band[..., ::-1])
+            if progress is not None:
+                progress(stop, height)
+        return Mosaic(indices, self.palette)
+    
+    def parts_list(self, mosaic, unit_costs=None, unit_weights=None):
+        """Bricks needed for a mosaic as a PartsList (name, RGB, count, cost, weight per color).
+        
+        Costs and weights are optional per-brick values: one number for all
+        colors or a dict keyed by color name.
+        """
+        with self.instrumentation.stage('count'):
+            return PartsList.from_mosaic(mosaic, unit_costs, unit_weights)
     
     def create_color_mapping(self, resized_img):
         """Create a mapping of colors used in the mosaic"""
@@ -0,0 +1,82 @@
+"""Image decoding and resampling, through OpenCV when it is installed.
+
+OpenCV is imported on first use rather than at startup. Without it (or with
+LEGO_MOSAIC_NO_OPENCV set) images are decoded with Pillow and resampled with
+tiles.area_resize_band, which gives the same area average to within one
+level per channel. Arrays are BGR, as cv2.imread returns them.
+"""
+import os
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# Set to any non-empty value to ignore an installed OpenCV
+NO_OPENCV = bool(os.environ.get('LEGO_MOSAIC_NO_OPENCV'))
+
+_opencv = None
+
+
+def opencv():
+    """The cv2 module, imported on first call; None if it is unavailable or disabled."""
+    global _opencv
+    if _opencv is None:
+        _opencv = False
+        if not NO_OPENCV:
+            try:
+                import cv2
+                _opencv = cv2
+            except ImportError:
+                pass
+    return _opencv or None
+
+
+def read_image(path, reduction=1):
+    """Decode an image file to an (H, W, 3) uint8 BGR array, or None if it cannot be read.
+
+    ``reduction`` of 2, 4 or 8 lets JPEG files be decoded at that fraction of
+    their size. EXIF rotation is applied, as cv2.imread does.
+    """
+    cv2 = opencv()
+    if cv2 is not None:
+        if reduction > 1:
+            flag = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+            img = cv2.imread(path, flag[reduction])
+        else:
+            img = cv2.imread(path)
+        if img is None:
+            return None
+        # Check if image is grayscale and convert to RGB if needed
+        if len(img.shape) == 2:  # Grayscale image
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        elif img.shape[2] == 4:  # RGBA image
+            img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+        return img
+
+    try:
+        with Image.open(path) as img:
+            if reduction > 1:
+                # JPEG only: libjpeg scales while decoding, to ceil(size / reduction)
+                img.draft('RGB', (-(-img.width // reduction), -(-img.height // reduction)))
+            img = ImageOps.exif_transpose(img).convert('RGB')
+            return np.ascontiguousarray(np.asarray(img)[..., ::-1])
+    except (OSError, ValueError):
+        return None
+
+
+def resize_area(img, width, height):
+    """Resize an image to (height, width) by area averaging (cv2.INTER_AREA)."""
+    cv2 = opencv()
+    if cv2 is not None:
+        return cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+
+    from tiles import area_resize_band
+    orig_height, orig_width = img.shape[:2]
+    return area_resize_band(img, (0, 0, orig_width, orig_height), width, height, 0, height)
+
+
+def bgr_to_rgb(img):
+    """Swap the channel order of a BGR image into a new contiguous RGB array."""
+    cv2 = opencv()
+    if cv2 is not None:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return np.ascontiguousarray(img[..., ::-1])
@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+
+
+# One entry for every 24-bit RGB color, indexed by (r << 16) | (g << 8) | b
+LUT_SIZE = 1 << 24
+
+# Colors matched per call to CompiledPalette.nearest while building a table
+BUILD_CHUNK_SIZE = 4096
+
+# Lookup tables are stored here, one .npy file per palette fingerprint
+DEFAULT_CACHE_DIR = os.environ.get(
+    'LEGO_MOSAIC_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'lego-mosaic')
+)
+
+
+def pack_rgb(rgb_array):
+    """Pack an (..., 3) array of 8-bit RGB values into (...) integer LUT keys."""
+    rgb_array = np.asarray(rgb_array).astype(np.int32)
+    return (rgb_array[..., 0] << 16) | (rgb_array[..., 1] << 8) | rgb_array[..., 2]
+
+
+def lut_dtype(palette):
+    """Smallest unsigned dtype that can hold an index into the palette."""
+    if len(palette) <= 1 << 8:
+        return np.uint8
+    if len(palette) <= 1 << 16:
+        return np.uint16
+    raise ValueError("Palette is too large for a lookup table")
+
+
+def lut_path(palette, cache_dir=None):
+    """Location of the cached lookup table for a compiled palette."""
+    return os.path.join(cache_dir or DEFAULT_CACHE_DIR, f"lut-{palette.fingerprint()}.npy")
+
+
+def _build_red_plane(palette, red):
+    """Best palette index for every color with the given red value, in (g, b) order."""
+    green_blue = np.arange(1 << 16, dtype=np.int32)
+    colors = np.stack(
+        [np.full_like(green_blue, red), green_blue >> 8, green_blue & 0xFF], axis=-1
+    )
+    plane = np.empty(len(colors), dtype=lut_dtype(palette))
+    for start in range(0, len(colors), BUILD_CHUNK_SIZE):
+        plane[start:start + BUILD_CHUNK_SIZE] = palette.nearest(colors[start:start + BUILD_CHUNK_SIZE])
+    return plane
+
+
+def build_lut(palette, workers=None):
+    """Compute the best palette index for every 24-bit RGB color.
+
+    The 256 red planes are matched in a process pool with ``workers``
+    processes (all CPUs by default); ``workers=1`` builds in this process.
+    """
+    lut = np.empty(LUT_SIZE, dtype=lut_dtype(palette))
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        planes = map(_build_red_plane, repeat(palette), range(256))
+        for red, plane in enumerate(planes):
+            lut[red << 16:(red + 1) << 16] = plane
+        return lut
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        planes = pool.map(_build_red_plane, repeat(palette), range(256))
+        for red, plane in enumerate(planes):
+            lut[red << 16:(red + 1) << 16] = plane
+    return lut
+
+
+def save_lut(lut, path):
+    """Write a lookup table atomically so concurrent readers never see a partial file."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        np.save(f, lut)
+    os.replace(temp_path, path)
+
+
+def load_lut(palette, cache_dir=None, build=True, workers=None):
+    """Return the memory-mapped lookup table for a palette.
+
+    A missing table is built and saved first when ``build`` is true;
+    otherwise None is returned.
+    """
+    path = lut_path(palette, cache_dir)
+    if not os.path.exists(path):
+        if not build:
+            return None
+        save_lut(build_lut(palette, workers), path)
+    return np.load(path, mmap_mode='r')
+
+
+# Build the table for the default palette ahead of time
+if __name__ == "__main__":
+    from generator import BasicMosaicGenerator
+
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    palette = BasicMosaicGenerator().palette
+    path = lut_path(palette)
+    if os.path.exists(path):
+        print(f"Lookup table already cached: {path}")
+    else:
+        start = time.perf_counter()
+        save_lut(build_lut(palette, workers), path)
+        print(f"Built lookup table in {time.perf_counter() - start:.1f}s: {path}")
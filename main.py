@@ -1,14 +1,62 @@
+import queue
+import threading
 import tkinter as tk
-from tkinter import messagebox, filedialog
-from generator import BasicMosaicGenerator
-from PIL import Image, ImageDraw
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import messagebox, filedialog, ttk
+from PIL import Image, ImageTk
+from cache import ImageCache
+from export import output_format, save_mosaic
+from generator import BasicMosaicGenerator, MosaicCancelled
+from instrument import Instrumentation
+from render import SCALE_FACTOR, render_mosaic
 
 root = tk.Tk()
 root.title("Lego Mosaic Generator")
-root.geometry("500x500")
+root.geometry("860x600")
+
+# Decoded and resized images, shared by generation and preview so trying sizes skips decoding
+image_cache = ImageCache()
 
 # Initialize the generator
-generator = BasicMosaicGenerator()
+generator = BasicMosaicGenerator(image_cache=image_cache)
+
+# Match through the cached lookup table when one has been built (make lut)
+generator.load_lookup_table(build=False)
+
+# Generation runs one job at a time on this background thread; later jobs wait in its queue
+executor = ThreadPoolExecutor(max_workers=1)
+
+# Messages from the background thread, drained on the Tk thread by poll_events
+events = queue.Queue()
+
+# Submitted jobs that have not finished yet, oldest first
+pending_jobs = []
+
+# Live preview: its own generator and thread, so previews never wait behind a full generation
+PREVIEW_SIZE = 320  # Preview area in pixels
+PREVIEW_DELAY_MS = 250  # Wait for typing to settle before re-matching
+PREVIEW_MIN_CELLS = 8  # Coarse passes keep at least this many cells per side
+preview_generator = BasicMosaicGenerator(image_cache=image_cache)
+preview_generator.load_lookup_table(build=False)
+preview_executor = ThreadPoolExecutor(max_workers=1)
+preview_state = {
+    'request': None,      # Latest match request (file, size, cancel flag)
+    'mosaic': None,       # Most refined mosaic received for that request
+    'mosaic_key': None,   # (file, width, height) of a fully refined mosaic
+    'after_id': None,     # Pending debounce timer
+    'photo': None,        # Keeps the Tk image alive while shown
+}
+
+# Preview area (packed first so it keeps the right-hand side of the window)
+preview_frame = tk.Frame(root)
+preview_frame.pack(side=tk.RIGHT, fill=tk.BOTH, padx=10, pady=10)
+preview_canvas = tk.Canvas(preview_frame, width=PREVIEW_SIZE, height=PREVIEW_SIZE, bg="white")
+preview_canvas.pack()
+preview_image_item = preview_canvas.create_image(PREVIEW_SIZE // 2, PREVIEW_SIZE // 2)
+preview_status_var = tk.StringVar()
+preview_status_var.set("Preview")
+preview_status = tk.Label(preview_frame, textvariable=preview_status_var, font=("Arial", 10), fg="gray")
+preview_status.pack(pady=5)
 
 label = tk.Label(root, text="Lego Mosaic Generator", font=("Arial", 14))
 label.pack(pady=20)
@@ -28,7 +76,7 @@ def select_file():
     file_path = filedialog.askopenfilename(
         title="Select Image File",
         filetypes=[
-            ("Image files", "*.png *.jpg *.jpeg *.gif *.bmp"),
+            ("Image files", "*.png *.jpg *.jpeg *.gif *.bmp *.webp *.tif *.tiff"),
             ("All files", "*.*")
         ]
     )
@@ -54,7 +102,9 @@ def select_save_path():
         defaultextension=".png",
         filetypes=[
             ("PNG files", "*.png"),
+            ("WebP files (lossless)", "*.webp"),
             ("JPEG files", "*.jpg"),
+            ("Palette indices", "*.npz"),
             ("All files", "*.*")
         ]
     )
@@ -104,6 +154,144 @@ studs_var.set(True)  # Show studs by default
 studs_checkbox = tk.Checkbutton(studs_frame, text="Show Lego Studs", variable=studs_var, font=("Arial", 10))
 studs_checkbox.pack()
 
+# Fast save option
+fast_frame = tk.Frame(root)
+fast_frame.pack(pady=2)
+fast_var = tk.BooleanVar()
+fast_var.set(False)  # Smaller files by default
+fast_checkbox = tk.Checkbutton(fast_frame, text="Fast Save (larger files)", variable=fast_var, font=("Arial", 10))
+fast_checkbox.pack()
+
+# Dithering option
+DITHER_LABELS = {
+    "None": 'none',
+    "Floyd-Steinberg": 'floyd-steinberg',
+    "Atkinson": 'atkinson',
+    "Bayer (ordered)": 'bayer',
+}
+dither_frame = tk.Frame(root)
+dither_frame.pack(pady=2)
+dither_label = tk.Label(dither_frame, text="Dithering:", font=("Arial", 10))
+dither_label.pack(side=tk.LEFT, padx=(0,5))
+dither_var = tk.StringVar()
+dither_var.set("None")  # Plain nearest-color matching by default
+dither_menu = tk.OptionMenu(dither_frame, dither_var, *DITHER_LABELS)
+dither_menu.pack(side=tk.LEFT)
+
+# Color limit option (0 uses the whole palette)
+colors_frame = tk.Frame(root)
+colors_frame.pack(pady=2)
+colors_label = tk.Label(colors_frame, text="Max colors (0 = all):", font=("Arial", 10))
+colors_label.pack(side=tk.LEFT, padx=(0,5))
+colors_var = tk.StringVar()
+colors_var.set("0")
+colors_entry = tk.Entry(colors_frame, textvariable=colors_var, width=5)
+colors_entry.pack(side=tk.LEFT)
+
+def run_generation(job):
+    """Generate, render, save and count one job on the background thread."""
+    def report_progress(rows_done, total_rows):
+        if job['cancel'].is_set():
+            raise MosaicCancelled()
+        events.put(('progress', job, rows_done, total_rows))
+    
+    # Jobs run one at a time on this thread, so each can have the generator's timers to itself
+    instrumentation = Instrumentation()
+    generator.instrumentation = instrumentation
+    try:
+        if job['cancel'].is_set():
+            raise MosaicCancelled()
+        events.put(('status', job, "Matching colors..."))
+        
+        # Generate the mosaic
+        width, height = job['width'], job['height']
+        mosaic = generator.generate_mosaic(
+            job['file_path'], width, height, progress=report_progress, dither=job['dither'],
+            max_colors=job['max_colors'],
+        )
+        
+        # Scale factor for better visibility (each pixel becomes a larger square)
+        scale_factor = SCALE_FACTOR  # Each mosaic pixel becomes 20x20 pixels
+        output_width = width * scale_factor
+        output_height = height * scale_factor
+        
+        # Render and save; PNGs are written as palette images, straight from the palette indices
+        if job['cancel'].is_set():
+            raise MosaicCancelled()
+        events.put(('status', job, "Saving..."))
+        save_mosaic(
+            mosaic, job['save_path'], scale_factor, job['show_grid'], job['show_studs'],
+            fast=job['fast_save'], instrumentation=instrumentation,
+        )
+        
+        # Count color usage
+        parts = generator.parts_list(mosaic)
+        
+        # Create info message
+        info_text = f"Mosaic generated successfully!\n\nOutput: {job['save_path']}\nSize: {width}x{height} (scaled to {output_width}x{output_height})"
+        info_text += f"\nTime: {instrumentation.summary()}\n\nColor usage:"
+        for part in parts:
+            info_text += f"\n{part.name}: {part.count} bricks"
+        events.put(('done', job, info_text))
+        
+    except MosaicCancelled:
+        events.put(('cancelled', job))
+    except Exception as e:
+        events.put(('error', job, f"Failed to generate mosaic: {str(e)}"))
+
+def update_queue_status():
+    waiting = len(pending_jobs) - 1
+    queue_var.set(f"{waiting} more image(s) queued" if waiting > 0 else "")
+    cancel_button.config(state=tk.NORMAL if pending_jobs else tk.DISABLED)
+
+def finish_job(job):
+    if job in pending_jobs:
+        pending_jobs.remove(job)
+    progress_bar['value'] = 0
+    update_queue_status()
+
+def poll_events():
+    """Apply progress and results from the background thread on the Tk thread."""
+    while True:
+        try:
+            event = events.get_nowait()
+        except queue.Empty:
+            break
+        kind, job = event[0], event[1]
+        if kind == 'preview':
+            # Ignore passes from a request that has since been replaced
+            if job is preview_state['request']:
+                mosaic, final = event[2], event[3]
+                preview_state['mosaic'] = mosaic
+                if final:
+                    preview_state['mosaic_key'] = job['key']
+                preview_status_var.set(
+                    f"Preview {mosaic.width}x{mosaic.height}" + ("" if final else " (refining...)")
+                )
+                show_preview()
+        elif kind == 'preview_error':
+            if job is preview_state['request']:
+                preview_status_var.set(f"Preview failed: {event[2]}")
+        elif kind == 'progress':
+            rows_done, total_rows = event[2], event[3]
+            progress_bar['maximum'] = total_rows
+            progress_bar['value'] = rows_done
+            status_var.set(f"Matching colors... row {rows_done}/{total_rows}")
+        elif kind == 'status':
+            status_var.set(event[2])
+        elif kind == 'done':
+            finish_job(job)
+            status_var.set("Done")
+            messagebox.showinfo(title="Basic Mosaic Generator", message=event[2])
+        elif kind == 'cancelled':
+            finish_job(job)
+            status_var.set("Cancelled")
+        elif kind == 'error':
+            finish_job(job)
+            status_var.set("Failed")
+            messagebox.showerror("Error", event[2])
+    root.after(50, poll_events)
+
 def generate_mosaic():
     try:
         file_path = file_var.get()
@@ -116,85 +304,161 @@ def generate_mosaic():
         if width <= 0 or height <= 0:
             messagebox.showerror("Error", "Width and height must be positive numbers.")
             return
+        max_colors = int(colors_var.get() or 0)
+        if max_colors < 0:
+            messagebox.showerror("Error", "Max colors cannot be negative.")
+            return
         
-        # Get save path
-        save_path = save_var.get()
-        
-        # Generate the mosaic
-        mosaic = generator.generate_mosaic(file_path, width, height)
-        
-        # Create output image with grid
-        # Scale factor for better visibility (each pixel becomes a larger square)
-        scale_factor = 20  # Each mosaic pixel becomes 20x20 pixels
-        grid_color = (100, 100, 100)  # Dark gray for grid lines
-        show_grid = grid_var.get()  # Get grid setting
-        show_studs = studs_var.get()  # Get studs setting
-        
-        # Create larger output image
-        output_width = width * scale_factor
-        output_height = height * scale_factor
-        output_img = Image.new('RGB', (output_width, output_height), (255, 255, 255))
-        draw = ImageDraw.Draw(output_img)
-        
-        # Draw mosaic pixels as larger squares
-        for y in range(height):
-            for x in range(width):
-                color = mosaic[y][x]
-                # Calculate square coordinates
-                x1 = x * scale_factor
-                y1 = y * scale_factor
-                x2 = x1 + scale_factor
-                y2 = y1 + scale_factor
-                
-                # Draw filled square (Lego brick base)
-                if show_grid:
-                    draw.rectangle([x1, y1, x2, y2], fill=color, outline=grid_color)
-                else:
-                    draw.rectangle([x1, y1, x2, y2], fill=color)
-                
-                # Draw Lego stud (circular top) if enabled
-                if show_studs:
-                    stud_radius = scale_factor // 3  # Stud size
-                    stud_center_x = x1 + scale_factor // 2
-                    stud_center_y = y1 + scale_factor // 2
-                    
-                    # Create darker shade for the stud (3D effect)
-                    stud_color = tuple(max(0, c - 40) for c in color)  # Darker version of the color
-                    
-                    # Draw stud circle
-                    stud_x1 = stud_center_x - stud_radius
-                    stud_y1 = stud_center_y - stud_radius
-                    stud_x2 = stud_center_x + stud_radius
-                    stud_y2 = stud_center_y + stud_radius
-                    draw.ellipse([stud_x1, stud_y1, stud_x2, stud_y2], fill=stud_color)
-        
-        # Save the image
-        output_img.save(save_path)
-        
-        # Count color usage
-        color_counts = {}
-        for row in mosaic:
-            for color in row:
-                color_name = None
-                for name, rgb in generator.basic_colors.items():
-                    if rgb == color:
-                        color_name = name
-                        break
-                if color_name:
-                    color_counts[color_name] = color_counts.get(color_name, 0) + 1
-        
-        # Create info message
-        info_text = f"Mosaic generated successfully!\n\nOutput: {save_path}\nSize: {width}x{height} (scaled to {output_width}x{output_height})\n\nColor usage:"
-        for color, count in sorted(color_counts.items(), key=lambda x: x[1], reverse=True):
-            info_text += f"\n{color}: {count} bricks"
+        # Catch an unsupported save format before spending time on generation
+        output_format(save_var.get())
         
-        messagebox.showinfo(title="Basic Mosaic Generator", message=info_text)
+        # Snapshot the settings; the job runs later on the background thread
+        job = {
+            'file_path': file_path,
+            'save_path': save_var.get(),
+            'width': width,
+            'height': height,
+            'show_grid': grid_var.get(),
+            'show_studs': studs_var.get(),
+            'fast_save': fast_var.get(),
+            'dither': DITHER_LABELS[dither_var.get()],
+            'max_colors': max_colors,
+            'cancel': threading.Event(),
+        }
+        pending_jobs.append(job)
+        update_queue_status()
+        if len(pending_jobs) == 1:
+            status_var.set("Starting...")
+        executor.submit(run_generation, job)
         
     except Exception as e:
         messagebox.showerror("Error", f"Failed to generate mosaic: {str(e)}")
 
+def preview_levels(width, height):
+    """Downsampling factors for successive preview passes, coarsest first."""
+    levels = [
+        factor for factor in (8, 4, 2)
+        if width // factor >= PREVIEW_MIN_CELLS and height // factor >= PREVIEW_MIN_CELLS
+    ]
+    return levels + [1]
+
+def run_preview(request):
+    """Match the preview on its background thread, coarse passes first."""
+    def check_cancel(rows_done, total_rows):
+        if request['cancel'].is_set():
+            raise MosaicCancelled()
+    
+    file_path, width, height, dither, max_colors = request['key']
+    try:
+        for factor in preview_levels(width, height):
+            if request['cancel'].is_set():
+                return
+            mosaic = preview_generator.generate_mosaic(
+                file_path, max(1, width // factor), max(1, height // factor), progress=check_cancel,
+                dither=dither, max_colors=max_colors,
+            )
+            events.put(('preview', request, mosaic, factor == 1))
+    except MosaicCancelled:
+        pass
+    except Exception as e:
+        events.put(('preview_error', request, str(e)))
+
+def start_preview():
+    """Re-match the preview if the image, board size, dithering or color limit changed since the last one."""
+    preview_state['after_id'] = None
+    file_path = file_var.get()
+    try:
+        width = int(width_var.get())
+        height = int(height_var.get())
+        max_colors = int(colors_var.get() or 0)
+    except ValueError:
+        return
+    if file_path == "No file selected" or width <= 0 or height <= 0 or max_colors < 0:
+        return
+    
+    key = (file_path, width, height, DITHER_LABELS[dither_var.get()], max_colors)
+    if key == preview_state['mosaic_key']:
+        show_preview()
+        return
+    if preview_state['request'] is not None:
+        preview_state['request']['cancel'].set()
+    request = {'key': key, 'cancel': threading.Event()}
+    preview_state['request'] = request
+    preview_state['mosaic_key'] = None
+    preview_status_var.set("Matching preview...")
+    preview_executor.submit(run_preview, request)
+
+def schedule_preview(*args):
+    """Debounced trigger for changes that need a new match (image, size, dithering, color limit)."""
+    if preview_state['after_id'] is not None:
+        root.after_cancel(preview_state['after_id'])
+    preview_state['after_id'] = root.after(PREVIEW_DELAY_MS, start_preview)
+
+def show_preview(*args):
+    """Render the current preview mosaic; grid and stud toggles only need this step."""
+    mosaic = preview_state['mosaic']
+    request = preview_state['request']
+    if mosaic is None or request is None:
+        return
+    
+    # Fit the full board into the preview area; coarse passes are scaled up to the same size
+    _, width, height, _, _ = request['key']
+    display_scale = PREVIEW_SIZE / max(width, height)
+    display_size = (max(1, round(width * display_scale)), max(1, round(height * display_scale)))
+    scale_factor = max(1, PREVIEW_SIZE // max(mosaic.width, mosaic.height))
+    image = render_mosaic(mosaic, scale_factor, grid_var.get(), studs_var.get())
+    if image.size != display_size:
+        image = image.resize(display_size, Image.NEAREST)
+    
+    preview_state['photo'] = ImageTk.PhotoImage(image)
+    preview_canvas.itemconfig(preview_image_item, image=preview_state['photo'])
+
+def cancel_generation():
+    """Cancel the job that is currently running; queued jobs still run."""
+    if pending_jobs:
+        pending_jobs[0]['cancel'].set()
+        status_var.set("Cancelling...")
+
+def on_close():
+    for job in pending_jobs:
+        job['cancel'].set()
+    if preview_state['request'] is not None:
+        preview_state['request']['cancel'].set()
+    executor.shutdown(wait=False, cancel_futures=True)
+    preview_executor.shutdown(wait=False, cancel_futures=True)
+    root.destroy()
+
 generate_button = tk.Button(root, text="Generate Mosaic", command=generate_mosaic, 
                            font=("Arial", 12), bg="#4CAF50")
-generate_button.pack(pady=20)
+generate_button.pack(pady=(20,5))
+
+# Progress section
+progress_bar = ttk.Progressbar(root, orient=tk.HORIZONTAL, length=300, mode='determinate')
+progress_bar.pack(pady=5)
+
+status_var = tk.StringVar()
+status_var.set("")
+status_label = tk.Label(root, textvariable=status_var, font=("Arial", 10))
+status_label.pack()
+
+queue_var = tk.StringVar()
+queue_var.set("")
+queue_label = tk.Label(root, textvariable=queue_var, font=("Arial", 10), fg="gray")
+queue_label.pack()
+
+cancel_button = tk.Button(root, text="Cancel", command=cancel_generation, state=tk.DISABLED)
+cancel_button.pack(pady=5)
+
+# Image, size, dithering and color limit changes re-match the preview; grid and stud toggles only re-render it
+file_var.trace_add('write', schedule_preview)
+width_var.trace_add('write', schedule_preview)
+height_var.trace_add('write', schedule_preview)
+dither_var.trace_add('write', schedule_preview)
+colors_var.trace_add('write', schedule_preview)
+grid_var.trace_add('write', show_preview)
+studs_var.trace_add('write', show_preview)
+
+root.protocol("WM_DELETE_WINDOW", on_close)
+root.after(50, poll_events)
 
 root.mainloop()
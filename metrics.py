@@ -0,0 +1,119 @@
+"""CIE color difference formulas as NumPy kernels for palette matching.
+
+Each kernel takes the lab_terms of two sets of colors that broadcast
+against each other, e.g. pixels as (N, 1) columns against a (P,) palette,
+and returns the color difference of every pair. The first set is the
+reference color (the pixel), which matters for the asymmetric CIE94.
+Palettes compute their lab_terms once; the pixel side is computed per
+block of pixels.
+"""
+import numpy as np
+
+# Matching distances a CompiledPalette can use; 'blend' is the original model in palette.py
+METRICS = ('blend', 'cie76', 'cie94', 'ciede2000')
+
+# How many times smaller a scan block is than for 'blend', for kernels with more temporaries
+BLOCK_DIVISORS = {'cie94': 2, 'ciede2000': 8}
+
+# CIE94 graphic-arts constants (kL = kC = kH = 1)
+CIE94_K1 = 0.045
+CIE94_K2 = 0.015
+
+_25_POW_7 = 25.0 ** 7
+
+
+def lab_terms(lab):
+    """(L, a, b, chroma) arrays for an (..., 3) LAB array: the per-color parts of every formula."""
+    lab = np.asarray(lab, dtype=np.float64)
+    L, a, b = lab[..., 0], lab[..., 1], lab[..., 2]
+    return L, a, b, np.hypot(a, b)
+
+
+def column_terms(terms):
+    """lab_terms reshaped as (N, 1) columns, to broadcast against a palette's (P,) terms."""
+    return tuple(term[:, np.newaxis] for term in terms)
+
+
+def cie76(terms1, terms2):
+    """CIE76: Euclidean distance in LAB."""
+    L1, a1, b1, _ = terms1
+    L2, a2, b2, _ = terms2
+    distance = (L2 - L1) ** 2
+    distance += (a2 - a1) ** 2
+    distance += (b2 - b1) ** 2
+    return np.sqrt(distance, out=distance)
+
+
+def cie94(terms1, terms2):
+    """CIE94 (graphic arts), with the first color as the reference."""
+    L1, a1, b1, C1 = terms1
+    L2, a2, b2, C2 = terms2
+    delta_C = C1 - C2
+    # Hue difference from what is left of the a/b difference once chroma is accounted for
+    delta_H_squared = (a1 - a2) ** 2
+    delta_H_squared += (b1 - b2) ** 2
+    delta_H_squared -= delta_C ** 2
+    np.maximum(delta_H_squared, 0, out=delta_H_squared)
+
+    distance = (L1 - L2) ** 2
+    distance += (delta_C / (1 + CIE94_K1 * C1)) ** 2
+    distance += delta_H_squared / (1 + CIE94_K2 * C1) ** 2
+    return np.sqrt(distance, out=distance)
+
+
+def ciede2000(terms1, terms2):
+    """CIEDE2000 (kL = kC = kH = 1), following Sharma, Wu and Dalal (2005)."""
+    L1, a1, b1, C1 = terms1
+    L2, a2, b2, C2 = terms2
+
+    # Stretch a* for near-neutral colors, then recompute chroma and hue
+    mean_C7 = ((C1 + C2) / 2) ** 7
+    G = 0.5 * (1 - np.sqrt(mean_C7 / (mean_C7 + _25_POW_7)))
+    a1p = (1 + G) * a1
+    a2p = (1 + G) * a2
+    C1p = np.hypot(a1p, b1)
+    C2p = np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360
+
+    # Hue difference, taken the short way round; zero when either color is neutral
+    chroma_product = C1p * C2p
+    neutral = chroma_product == 0
+    dhp = h2p - h1p
+    dhp = np.where(dhp > 180, dhp - 360, np.where(dhp < -180, dhp + 360, dhp))
+    dhp[neutral] = 0
+    delta_Hp = 2 * np.sqrt(chroma_product) * np.sin(np.radians(dhp / 2))
+    delta_Lp = L2 - L1
+    delta_Cp = C2p - C1p
+
+    # Mean hue, also taken the short way round
+    hue_sum = h1p + h2p
+    mean_hp = np.where(
+        np.abs(h1p - h2p) <= 180, hue_sum / 2,
+        np.where(hue_sum < 360, (hue_sum + 360) / 2, (hue_sum - 360) / 2),
+    )
+    mean_hp = np.where(neutral, hue_sum, mean_hp)
+    mean_Lp = (L1 + L2) / 2
+    mean_Cp = (C1p + C2p) / 2
+
+    T = (1 - 0.17 * np.cos(np.radians(mean_hp - 30)) + 0.24 * np.cos(np.radians(2 * mean_hp))
+         + 0.32 * np.cos(np.radians(3 * mean_hp + 6)) - 0.20 * np.cos(np.radians(4 * mean_hp - 63)))
+    delta_theta = 30 * np.exp(-((mean_hp - 275) / 25) ** 2)
+    mean_Cp7 = mean_Cp ** 7
+    R_C = 2 * np.sqrt(mean_Cp7 / (mean_Cp7 + _25_POW_7))
+    lightness = (mean_Lp - 50) ** 2
+    S_L = 1 + 0.015 * lightness / np.sqrt(20 + lightness)
+    S_C = 1 + 0.045 * mean_Cp
+    S_H = 1 + 0.015 * mean_Cp * T
+    R_T = -np.sin(np.radians(2 * delta_theta)) * R_C
+
+    dL = delta_Lp / S_L
+    dC = delta_Cp / S_C
+    dH = delta_Hp / S_H
+    distance = dL * dL + dC * dC + dH * dH + R_T * dC * dH
+    # Rounding can leave a tiny negative for identical colors
+    np.maximum(distance, 0, out=distance)
+    return np.sqrt(distance, out=distance)
+
+
+KERNELS = {'cie76': cie76, 'cie94': cie94, 'ciede2000': ciede2000}
@@ -0,0 +1,108 @@
+import json
+
+import numpy as np
+
+from palette import CompiledPalette
+
+
+def index_dtype(palette):
+    """uint16 palette indices, or uint32 for palettes beyond 65,536 colors."""
+    return np.uint16 if len(palette) <= 1 << 16 else np.uint32
+
+
+class Mosaic:
+    """A generated mosaic: an (H, W) grid of palette indices plus the palette.
+
+    Indexing and iteration behave like the list of rows of RGB tuples that
+    generate_mosaic used to return, so ``mosaic[y][x]`` is still a color.
+    """
+
+    def __init__(self, indices, palette):
+        indices = np.asarray(indices)
+        if indices.ndim != 2:
+            raise ValueError("Mosaic indices must be a 2D array")
+        self.indices = np.ascontiguousarray(indices, dtype=index_dtype(palette))
+        self.palette = palette
+
+    @property
+    def height(self):
+        return self.indices.shape[0]
+
+    @property
+    def width(self):
+        return self.indices.shape[1]
+
+    @property
+    def shape(self):
+        return self.indices.shape
+
+    def __len__(self):
+        return self.height
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            y, x = key
+            return self.palette.colors[self.indices[y, x]]
+        if isinstance(key, slice):
+            return [self._row(y) for y in range(*key.indices(self.height))]
+        return self._row(key)
+
+    def __iter__(self):
+        for y in range(self.height):
+            yield self._row(y)
+
+    def __eq__(self, other):
+        if isinstance(other, Mosaic):
+            return np.array_equal(self.to_rgb_array(), other.to_rgb_array())
+        if isinstance(other, list):
+            return self.tolist() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Mosaic({self.width}x{self.height}, {len(self.palette)} colors)"
+
+    def _row(self, y):
+        colors = self.palette.colors
+        return [colors[index] for index in self.indices[y].tolist()]
+
+    def tolist(self):
+        """The mosaic as a list of rows of RGB tuples."""
+        colors = self.palette.colors
+        return [[colors[index] for index in row] for row in self.indices.tolist()]
+
+    def to_rgb_array(self):
+        """The mosaic as an (H, W, 3) uint8 RGB image."""
+        return self.palette.rgb[self.indices]
+
+    def index_counts(self):
+        """Number of cells using each palette entry, indexed like the palette."""
+        return np.bincount(self.indices.ravel(), minlength=len(self.palette))
+
+    def save(self, path, fast=False):
+        """Write the indices and palette (names and their aliases) to an .npz file.
+
+        ``fast`` skips compression, for a larger file written sooner.
+        """
+        save = np.savez if fast else np.savez_compressed
+        save(
+            path,
+            indices=self.indices,
+            rgb=self.palette.rgb,
+            names=np.array(self.palette.names),
+            aliases=np.array(json.dumps(self.palette.aliases)),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Read a mosaic written by save()."""
+        with np.load(path) as data:
+            rgb = [tuple(int(c) for c in color) for color in data['rgb']]
+            # Files from before aliases were stored have just the first name of each entry
+            if 'aliases' in data:
+                aliases = json.loads(str(data['aliases']))
+            else:
+                aliases = [[str(name)] for name in data['names']]
+            colors = {name: color for names, color in zip(aliases, rgb) for name in names}
+            return cls(data['indices'], CompiledPalette(colors))
@@ -0,0 +1,180 @@
+import csv
+import json
+from collections import namedtuple
+
+import numpy as np
+
+
+# One line of a parts list; cost and weight are None when no unit values were given
+Part = namedtuple('Part', ['name', 'rgb', 'count', 'cost', 'weight', 'aliases', 'size'], defaults=('1x1',))
+
+CSV_FIELDS = ['name', 'size', 'hex', 'r', 'g', 'b', 'count', 'cost', 'weight']
+
+
+def _unit_value(values, aliases):
+    """Per-piece value for a palette entry: a single number, or looked up by any of its names."""
+    if values is None:
+        return None
+    if isinstance(values, (int, float)):
+        return values
+    for name in aliases:
+        if name in values:
+            return values[name]
+    return None
+
+
+def _plate_value(values, aliases, size, studs):
+    """Per-piece value for one plate size: given for the size (per color or for all), else per stud."""
+    if isinstance(values, dict):
+        for name in aliases:
+            if isinstance(values.get(name), dict) and size in values[name]:
+                return values[name][size]
+        if isinstance(values.get(size), (int, float)):
+            return values[size]
+    unit = _unit_value(values, aliases)
+    if isinstance(unit, dict):
+        return None
+    return None if unit is None else unit * studs
+
+
+class PartsList:
+    """Bricks needed for a mosaic, one Part per palette color in use, most used first."""
+
+    def __init__(self, parts, width=None, height=None):
+        self.parts = list(parts)
+        self.width = width
+        self.height = height
+
+    @classmethod
+    def from_mosaic(cls, mosaic, unit_costs=None, unit_weights=None):
+        """Count the cells of each color with a single bincount over the palette indices.
+
+        ``unit_costs`` and ``unit_weights`` are either one number for every
+        brick or a dict keyed by color name (any alias of a color matches).
+        """
+        palette = mosaic.palette
+        counts = mosaic.index_counts()
+        used = np.flatnonzero(counts)
+        # Most used first, palette order among equal counts
+        used = used[np.argsort(-counts[used], kind='stable')]
+
+        parts = []
+        for index, count in zip(used.tolist(), counts[used].tolist()):
+            aliases = tuple(palette.aliases[index])
+            unit_cost = _unit_value(unit_costs, aliases)
+            unit_weight = _unit_value(unit_weights, aliases)
+            parts.append(Part(
+                name=palette.names[index],
+                rgb=palette.colors[index],
+                count=count,
+                cost=None if unit_cost is None else unit_cost * count,
+                weight=None if unit_weight is None else unit_weight * count,
+                aliases=aliases,
+            ))
+        return cls(parts, mosaic.width, mosaic.height)
+
+    @classmethod
+    def from_bricks(cls, layout, unit_costs=None, unit_weights=None):
+        """Count the plates of a bricks.BrickLayout by color and size, most used first.
+
+        Unit values work as in from_mosaic and are taken per stud, unless
+        given for a size: {'2x4': 0.12} for every color, or
+        {'Red': {'2x4': 0.15}} for one.
+        """
+        palette = layout.palette
+        short = np.minimum(layout.heights, layout.widths).astype(np.int64)
+        long = np.maximum(layout.heights, layout.widths).astype(np.int64)
+        footprints, size_numbers = np.unique(short << 16 | long, return_inverse=True)
+        # One count per (palette entry, size) pair
+        keys = layout.colors.astype(np.int64) * len(footprints) + size_numbers
+        keys, counts = np.unique(keys, return_counts=True)
+        order = np.lexsort((keys, -counts))
+
+        parts = []
+        for key, count in zip(keys[order].tolist(), counts[order].tolist()):
+            index, size_number = divmod(key, len(footprints))
+            rows, columns = divmod(int(footprints[size_number]), 1 << 16)
+            size = f"{rows}x{columns}"
+            aliases = tuple(palette.aliases[index])
+            unit_cost = _plate_value(unit_costs, aliases, size, rows * columns)
+            unit_weight = _plate_value(unit_weights, aliases, size, rows * columns)
+            parts.append(Part(
+                name=palette.names[index],
+                rgb=palette.colors[index],
+                count=count,
+                cost=None if unit_cost is None else unit_cost * count,
+                weight=None if unit_weight is None else unit_weight * count,
+                aliases=aliases,
+                size=size,
+            ))
+        return cls(parts, layout.mosaic.width, layout.mosaic.height)
+
+    def __iter__(self):
+        return iter(self.parts)
+
+    def __len__(self):
+        return len(self.parts)
+
+    @property
+    def total_count(self):
+        return sum(part.count for part in self.parts)
+
+    @property
+    def total_cost(self):
+        costs = [part.cost for part in self.parts if part.cost is not None]
+        return sum(costs) if costs else None
+
+    @property
+    def total_weight(self):
+        weights = [part.weight for part in self.parts if part.weight is not None]
+        return sum(weights) if weights else None
+
+    def as_dict(self):
+        """Plain-data form used for JSON export."""
+        return {
+            'width': self.width,
+            'height': self.height,
+            'total_count': self.total_count,
+            'total_cost': self.total_cost,
+            'total_weight': self.total_weight,
+            'parts': [
+                {
+                    'name': part.name,
+                    'size': part.size,
+                    'hex': '#{:02X}{:02X}{:02X}'.format(*part.rgb),
+                    'rgb': list(part.rgb),
+                    'count': part.count,
+                    'cost': part.cost,
+                    'weight': part.weight,
+                    'aliases': list(part.aliases),
+                }
+                for part in self.parts
+            ],
+        }
+
+    def to_json(self, path=None, indent=2):
+        """Return the parts list as JSON, also writing it to path if given."""
+        text = json.dumps(self.as_dict(), indent=indent)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def to_csv(self, path):
+        """Write one CSV row per color; empty cost/weight cells when not known."""
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            for part in self.parts:
+                r, g, b = part.rgb
+                writer.writerow({
+                    'name': part.name,
+                    'size': part.size,
+                    'hex': f'#{r:02X}{g:02X}{b:02X}',
+                    'r': r,
+                    'g': g,
+                    'b': b,
+                    'count': part.count,
+                    'cost': '' if part.cost is None else part.cost,
+                    'weight': '' if part.weight is None else part.weight,
+                })
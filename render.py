@@ -0,0 +1,153 @@
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+# Each mosaic cell becomes a SCALE_FACTOR x SCALE_FACTOR block of output pixels
+SCALE_FACTOR = 20
+
+# Dark gray for grid lines
+GRID_COLOR = (100, 100, 100)
+
+# How much darker a stud is than its brick, per channel (3D effect)
+STUD_SHADE = 40
+
+# Labels of the pixels in a cell stamp
+FILL, STUD, GRID = 0, 1, 2
+
+
+@lru_cache(maxsize=None)
+def cell_stamp(scale_factor=SCALE_FACTOR, show_grid=True, show_studs=True):
+    """(scale_factor, scale_factor) array labelling each pixel of one cell as FILL, STUD or GRID.
+
+    The stamp is drawn with the same PIL calls the per-cell renderer used, so
+    tiling it reproduces that output pixel for pixel. The bottom/right outline
+    of a cell is overdrawn by its neighbours and falls outside the stamp.
+    """
+    canvas = Image.new('L', (scale_factor + 1, scale_factor + 1), FILL)
+    draw = ImageDraw.Draw(canvas)
+    if show_grid:
+        draw.rectangle([0, 0, scale_factor, scale_factor], fill=FILL, outline=GRID)
+    if show_studs:
+        stud_radius = scale_factor // 3
+        center = scale_factor // 2
+        draw.ellipse(
+            [center - stud_radius, center - stud_radius, center + stud_radius, center + stud_radius],
+            fill=STUD,
+        )
+    stamp = np.asarray(canvas)[:scale_factor, :scale_factor].copy()
+    stamp.flags.writeable = False
+    return stamp
+
+
+def stud_shades(rgb):
+    """Darker stud color for each row of an (N, 3) RGB array."""
+    return np.clip(np.asarray(rgb, dtype=np.int16) - STUD_SHADE, 0, 255).astype(np.uint8)
+
+
+def pack_rgb32(rgb):
+    """Pack an (..., 3) RGB array into little-endian uint32 pixels laid out as RGBX bytes."""
+    rgb = np.asarray(rgb).astype('<u4')
+    return rgb[..., 0] | (rgb[..., 1] << 8) | (rgb[..., 2] << 16)
+
+
+def stamp_cells(cells, scale_factor=SCALE_FACTOR, show_grid=True, show_studs=True):
+    """(H*s, W*s) pixels from an (H, W, 3) array of each cell's value for every stamp label."""
+    stamp = cell_stamp(scale_factor, show_grid, show_studs)
+    height, width = cells.shape[:2]
+
+    # (H, s, W, s) pixels: each output row within a cell repeats one stamp row across the board
+    pixels = np.empty((height, scale_factor, width, scale_factor), dtype=cells.dtype)
+    drawn = {}
+    for y in range(scale_factor):
+        key = stamp[y].tobytes()
+        if key in drawn:
+            pixels[:, y] = pixels[:, drawn[key]]
+        else:
+            pixels[:, y] = cells[:, :, stamp[y]]
+            drawn[key] = y
+    return pixels.reshape(height * scale_factor, width * scale_factor)
+
+
+def render_packed(indices, palette_rgb, scale_factor=SCALE_FACTOR, show_grid=True,
+                  show_studs=True, grid_color=GRID_COLOR):
+    """Render an (H, W) grid of palette indices to (H*s, W*s) packed RGBX pixels (see pack_rgb32)."""
+    indices = np.asarray(indices)
+    palette_rgb = np.asarray(palette_rgb, dtype=np.uint8)
+
+    # Packed color of every stamp label for every palette entry: (P, 3 labels)
+    colors = np.empty((len(palette_rgb), 3), dtype='<u4')
+    colors[:, FILL] = pack_rgb32(palette_rgb)
+    colors[:, STUD] = pack_rgb32(stud_shades(palette_rgb))
+    colors[:, GRID] = pack_rgb32(grid_color)
+
+    return stamp_cells(colors[indices], scale_factor, show_grid, show_studs)
+
+
+def packed_image(pixels):
+    """RGB PIL image from (H, W) packed RGBX pixels."""
+    size = (pixels.shape[1], pixels.shape[0])
+    return Image.frombuffer('RGBX', size, pixels, 'raw', 'RGBX', 0, 1).convert('RGB')
+
+
+def render_indices(indices, palette_rgb, scale_factor=SCALE_FACTOR, show_grid=True,
+                   show_studs=True, grid_color=GRID_COLOR):
+    """Render an (H, W) grid of palette indices to an (W*s, H*s) RGB PIL image."""
+    return packed_image(render_packed(indices, palette_rgb, scale_factor, show_grid, show_studs, grid_color))
+
+
+def paletted_labels(fills, show_grid=True, show_studs=True, grid_color=GRID_COLOR):
+    """Palette for drawing the (U, 3) RGB ``fills`` as a 'P' image, or None past 256 colors.
+
+    Returns (colors, labels): the distinct colors drawn, and a (U, 3 labels)
+    uint8 array of the palette slot each stamp label takes for each fill.
+    """
+    fills = np.asarray(fills, dtype=np.uint8)
+
+    # Every color a stamp label can take, then each distinct one once
+    candidates = [fills]
+    if show_studs:
+        candidates.append(stud_shades(fills))
+    if show_grid:
+        candidates.append(np.asarray([grid_color], dtype=np.uint8))
+    colors, slots = np.unique(np.concatenate(candidates), axis=0, return_inverse=True)
+    if len(colors) > 256:
+        return None
+
+    count = len(fills)
+    labels = np.zeros((count, 3), dtype=np.uint8)
+    labels[:, FILL] = slots[:count]
+    if show_studs:
+        labels[:, STUD] = slots[count:2 * count]
+    if show_grid:
+        labels[:, GRID] = slots[-1]
+    return colors, labels
+
+
+def render_paletted(indices, palette_rgb, scale_factor=SCALE_FACTOR, show_grid=True,
+                    show_studs=True, grid_color=GRID_COLOR):
+    """render_indices as a 'P' image whose palette holds only the colors drawn.
+
+    Returns None when more than 256 colors would be needed: a fill and a
+    stud shade for each palette entry used, plus the grid color.
+    """
+    indices = np.asarray(indices)
+    used, local = np.unique(indices, return_inverse=True)
+    paletted = paletted_labels(np.asarray(palette_rgb)[used], show_grid, show_studs, grid_color)
+    if paletted is None:
+        return None
+    colors, labels = paletted
+
+    pixels = stamp_cells(labels[local.reshape(indices.shape)], scale_factor, show_grid, show_studs)
+    image = Image.fromarray(pixels, 'P')
+    image.putpalette(colors.tobytes())
+    return image
+
+
+def render_mosaic(mosaic, scale_factor=SCALE_FACTOR, show_grid=True, show_studs=True,
+                  grid_color=GRID_COLOR):
+    """Render a Mosaic as bricks with optional grid lines and studs, as a PIL image."""
+    return render_indices(
+        mosaic.indices, mosaic.palette.rgb, scale_factor, show_grid, show_studs, grid_color
+    )
@@ -0,0 +1,370 @@
+"""Long-running local HTTP service that turns uploaded images into mosaics.
+
+    python3 service.py --port 8765 --workers 4
+
+POST /mosaic with the image file (PNG, JPEG, GIF, BMP, WebP or TIFF) as the
+request body and the board settings in the query string: width, height,
+grid, studs, dither, colors and format (json, the default, or png). JSON
+responses carry the parts list and the rendered PNG in base64; png returns
+just the image. Example:
+
+    curl --data-binary @photo.jpg "http://127.0.0.1:8765/mosaic?width=48&height=48&format=png" -o out.png
+
+GET /metrics reports queue depth, coalesced requests and latency; GET /health
+answers "ok". Work runs in a pool of processes that each keep a warm
+generator (palette, lookup table, reduced palettes); if a worker dies, the
+pool is replaced and only the requests it was running fail. Identical requests
+(same image bytes and settings) that arrive while one is running share its
+result, and finished results are kept in a small cache. Only the standard
+library and the project's own dependencies are used.
+"""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from cache import LRUCache
+from dither import DITHER_METHODS
+from export import save_mosaic
+from instrument import Instrumentation
+from metrics import METRICS
+from render import SCALE_FACTOR
+from workers import init_worker, worker_generator
+
+DEFAULT_PORT = 8765
+
+# Uploads beyond this are refused with 413
+MAX_UPLOAD_BYTES = 64 << 20
+
+# Largest board side accepted, in studs
+MAX_BOARD_SIDE = 1000
+
+# Rendered results kept for repeat requests, bounded by PNG size
+RESULT_CACHE_BYTES = 128 << 20
+
+# Recent request latencies kept for the metrics percentiles
+LATENCY_WINDOW = 1000
+
+# File suffix for each recognised image signature, so the generator picks the right decoder
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+    (b'BM', '.bmp'),
+    (b'II*\x00', '.tif'),
+    (b'MM\x00*', '.tif'),
+)
+
+def image_suffix(data):
+    """File suffix for image bytes, or None if the format is not recognised."""
+    for signature, suffix in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return suffix
+    # RIFF container: size in bytes 4-8, then the form type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return '.webp'
+    return None
+
+
+def parse_params(query):
+    """Board settings from a query string; raises ValueError with a message for bad values."""
+    values = {name: items[-1] for name, items in parse_qs(query).items()}
+
+    def flag(name, default):
+        value = values.get(name)
+        if value is None:
+            return default
+        return value.lower() not in ('0', 'false', 'no', 'off')
+
+    params = {
+        'width': int(values.get('width', 32)),
+        'height': int(values.get('height', 64)),
+        'grid': flag('grid', True),
+        'studs': flag('studs', True),
+        'dither': values.get('dither', 'none'),
+        'colors': int(values.get('colors', 0)),
+        'format': values.get('format', 'json'),
+    }
+    if not (0 < params['width'] <= MAX_BOARD_SIDE and 0 < params['height'] <= MAX_BOARD_SIDE):
+        raise ValueError(f"width and height must be between 1 and {MAX_BOARD_SIDE}")
+    if params['dither'] not in DITHER_METHODS:
+        raise ValueError(f"dither must be one of {', '.join(DITHER_METHODS)}")
+    if params['colors'] < 0:
+        raise ValueError("colors cannot be negative")
+    if params['format'] not in ('json', 'png'):
+        raise ValueError("format must be json or png")
+    return params
+
+
+def render_job(data, suffix, params):
+    """Worker side: generate, render and encode one mosaic; returns (png bytes, parts dict, timings)."""
+    generator = worker_generator()
+    instrumentation = Instrumentation()
+    generator.instrumentation = instrumentation
+
+    # The generator reads from a path; the file only lives for this call
+    with tempfile.NamedTemporaryFile(suffix=suffix) as f:
+        f.write(data)
+        f.flush()
+        mosaic = generator.generate_mosaic(
+            f.name, params['width'], params['height'],
+            dither=params['dither'], max_colors=params['colors'] or None,
+        )
+
+    # Palette PNG straight from the indices: far quicker to encode than RGB, same pixels
+    buffer = io.BytesIO()
+    save_mosaic(
+        mosaic, buffer, SCALE_FACTOR, params['grid'], params['studs'], file_format='PNG',
+        instrumentation=instrumentation,
+    )
+    parts = generator.parts_list(mosaic)
+    return buffer.getvalue(), parts.as_dict(), dict(instrumentation.timings)
+
+
+class MosaicService:
+    """Process pool plus in-flight coalescing, result cache and metrics, shared by all handler threads."""
+
+    def __init__(self, workers=None, use_lut=True, metric='blend', prefilter=None):
+        self.workers = workers or os.cpu_count() or 1
+        self._worker_args = (use_lut, metric, prefilter)
+        self.pool = self._new_pool()
+        self.results = LRUCache(maxbytes=RESULT_CACHE_BYTES, sizeof=lambda result: len(result[0]))
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.started = time.time()
+        self.requests = 0
+        self.coalesced = 0
+        self.cached = 0
+        self.errors = 0
+        self.restarts = 0
+
+    def submit(self, data, params):
+        """Result of a render request, sharing any identical request already running or finished."""
+        suffix = image_suffix(data)
+        if suffix is None:
+            raise ValueError("Unsupported image format")
+        render_params = {name: value for name, value in params.items() if name != 'format'}
+        key = hashlib.sha256(data).hexdigest() + json.dumps(render_params, sort_keys=True)
+
+        with self._lock:
+            self.requests += 1
+            result = self.results.get(key)
+            if result is not None:
+                self.cached += 1
+                return result
+            future = self._in_flight.get(key)
+            submitted = future is None
+            if submitted:
+                pool = self.pool
+                try:
+                    future = pool.submit(render_job, data, suffix, render_params)
+                except BrokenProcessPool:
+                    # A worker died since the last job finished; start over with a fresh pool
+                    self.errors += 1
+                    pool = self._restart_pool(pool)
+                    future = pool.submit(render_job, data, suffix, render_params)
+                self._in_flight[key] = future
+            else:
+                self.coalesced += 1
+        # Outside the lock: a job that has already finished runs the callback here and now
+        if submitted:
+            future.add_done_callback(lambda done: self._finish(key, done, pool))
+        return future.result()
+
+    def _finish(self, key, future, pool):
+        with self._lock:
+            self._in_flight.pop(key, None)
+            error = future.exception()
+            if error is None:
+                self.results.put(key, future.result())
+                return
+            self.errors += 1
+            if isinstance(error, BrokenProcessPool):
+                self._restart_pool(pool)
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers, initializer=init_worker, initargs=self._worker_args
+        )
+
+    def _restart_pool(self, broken):
+        """Replace ``broken`` with a new pool, unless that has already happened; call with _lock held."""
+        if self.pool is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.pool = self._new_pool()
+            self.restarts += 1
+        return self.pool
+
+    def record_latency(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def metrics(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            in_flight = len(self._in_flight)
+            cache = self.results.stats()
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+        return {
+            'uptime_seconds': time.time() - self.started,
+            'workers': self.workers,
+            'queue_depth': in_flight,
+            'requests': self.requests,
+            'coalesced': self.coalesced,
+            'cached': self.cached,
+            'errors': self.errors,
+            'pool_restarts': self.restarts,
+            'latency_seconds': {
+                'count': len(latencies),
+                'mean': sum(latencies) / len(latencies) if latencies else None,
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'max': latencies[-1] if latencies else None,
+            },
+            'result_cache': cache,
+        }
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class MosaicRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end for a MosaicService (set on the server as ``server.service``)."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._send(200, b'ok\n', 'text/plain')
+        elif path == '/metrics':
+            self._send_json(200, self.server.service.metrics())
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/mosaic':
+            self._send_json(404, {'error': 'not found'})
+            return
+        start = time.perf_counter()
+        service = self.server.service
+        try:
+            self._post_mosaic(url, service)
+        finally:
+            # Every reply counts, errors and failed writes included
+            service.record_latency(time.perf_counter() - start)
+
+    def _post_mosaic(self, url, service):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length < 0:
+                # No way to tell where the body ends, so the connection cannot be reused
+                self._send_json(400, {'error': "Content-Length cannot be negative"})
+                self.close_connection = True
+                return
+            if length > MAX_UPLOAD_BYTES:
+                self._send_json(413, {'error': f"upload larger than {MAX_UPLOAD_BYTES} bytes"})
+                self.close_connection = True
+                return
+            data = self.rfile.read(length)
+            params = parse_params(url.query)
+            png, parts, timings = service.submit(data, params)
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {'error': f"Failed to generate mosaic: {e}"})
+            return
+
+        if params['format'] == 'png':
+            self._send(200, png, 'image/png')
+        else:
+            self._send_json(200, {
+                'width': params['width'],
+                'height': params['height'],
+                'parts': parts,
+                'timings': timings,
+                'png': base64.b64encode(png).decode('ascii'),
+            })
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload).encode(), 'application/json')
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(host='127.0.0.1', port=DEFAULT_PORT, workers=None, use_lut=True, verbose=False,
+                metric='blend', prefilter=None):
+    """A ThreadingHTTPServer with a MosaicService attached; call serve_forever() on it."""
+    server = ThreadingHTTPServer((host, port), MosaicRequestHandler)
+    server.daemon_threads = True
+    server.service = MosaicService(workers, use_lut, metric, prefilter)
+    server.verbose = verbose
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve Lego mosaics over local HTTP.",
+        epilog=__doc__.split('\n\n', 1)[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--host', default='127.0.0.1', help="address to bind (default 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"port (default {DEFAULT_PORT})")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all CPUs)")
+    parser.add_argument('--no-lut', action='store_true', help="ignore a cached RGB lookup table")
+    parser.add_argument('--metric', choices=METRICS, default='blend',
+                        help="color distance used for matching (default blend)")
+    parser.add_argument('--prefilter', type=int, default=None, metavar='K',
+                        help="score cie94/ciede2000 only on the K nearest colors in CIE76 (default: all)")
+    parser.add_argument('--verbose', action='store_true', help="log every request")
+    args = parser.parse_args(argv)
+    if args.prefilter is not None and args.prefilter < 1:
+        parser.error("--prefilter must be at least 1")
+
+    server = make_server(
+        args.host, args.port, args.workers, not args.no_lut, args.verbose,
+        args.metric, args.prefilter,
+    )
+    print(f"Serving mosaics on http://{args.host}:{server.server_address[1]} "
+          f"with {server.service.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
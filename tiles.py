@@ -0,0 +1,269 @@
+"""Bounded-memory processing for very large sources and boards.
+
+Sources are resampled one band of mosaic rows at a time, renders are written
+as PNG or TIFF a strip of rows at a time, and boards can be split into
+per-baseplate instruction tiles. Nothing here holds a whole rendered board.
+"""
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from mosaic import Mosaic
+from parts import PartsList
+from render import SCALE_FACTOR, GRID_COLOR, paletted_labels, render_indices, stamp_cells
+
+# Working memory aimed for by one source band or one rendered output strip
+STRIP_BYTES = 64 << 20
+
+# Studs along each side of a standard baseplate
+PLATE_SIZE = 32
+
+# zlib level for PNG and TIFF strips (the same default PIL uses for PNG)
+COMPRESS_LEVEL = 6
+
+# Largest file offset a classic (non-BigTIFF) TIFF can address
+TIFF_MAX_OFFSET = (1 << 32) - 1
+
+
+def band_rows(row_bytes, budget=STRIP_BYTES):
+    """Rows of ``row_bytes`` each that fit in the working memory budget (at least one)."""
+    return max(1, int(budget // max(1, row_bytes)))
+
+
+def _area_sums(values, bounds):
+    """Sum of ``values`` along axis 0 between consecutive fractional ``bounds``.
+
+    Bounds are in pixel units relative to values[0]; a boundary inside a pixel
+    takes the matching fraction of it, as area interpolation does.
+    """
+    cumulative = np.zeros((len(values) + 1,) + values.shape[1:], dtype=np.float64)
+    np.cumsum(values, axis=0, out=cumulative[1:])
+    whole = np.minimum(np.floor(bounds).astype(np.intp), len(values) - 1)
+    fraction = (bounds - whole).reshape((-1,) + (1,) * (values.ndim - 1))
+    at_bounds = cumulative[whole] + fraction * (cumulative[whole + 1] - cumulative[whole])
+    return at_bounds[1:] - at_bounds[:-1]
+
+
+def area_resize_band(source, box, width, height, start, stop):
+    """Rows ``start:stop`` of the (height, width) area resize of ``source`` cropped to ``box``.
+
+    Equivalent to cv2.resize(cropped, (width, height), interpolation=INTER_AREA)
+    on the whole crop to within one level per channel, but only reads the
+    source rows that band covers, so ``source`` may be a memory map.
+    """
+    start_x, start_y, crop_width, crop_height = box
+    scale_x = crop_width / width
+    scale_y = crop_height / height
+
+    top = start * scale_y
+    bottom = stop * scale_y
+    first_row = int(np.floor(top))
+    last_row = min(int(np.ceil(bottom)), crop_height)
+    band = source[start_y + first_row:start_y + last_row, start_x:start_x + crop_width]
+
+    row_bounds = np.arange(start, stop + 1) * scale_y - first_row
+    rows = _area_sums(band, np.clip(row_bounds, 0, last_row - first_row))
+    column_bounds = np.arange(width + 1) * scale_x
+    cells = _area_sums(rows.swapaxes(0, 1), column_bounds).swapaxes(0, 1)
+    cells /= scale_x * scale_y
+    return np.clip(np.rint(cells), 0, 255).astype(np.uint8)
+
+
+def _render_strips(mosaic, scale_factor, show_grid, show_studs, grid_color, strip_rows):
+    """Yield rendered (rows * scale, width * scale, 3) uint8 strips of the board, top to bottom."""
+    if strip_rows is None:
+        strip_rows = band_rows(mosaic.width * scale_factor * scale_factor * 16)
+    rgb = mosaic.palette.rgb
+    for start in range(0, mosaic.height, strip_rows):
+        image = render_indices(
+            mosaic.indices[start:start + strip_rows], rgb, scale_factor, show_grid, show_studs, grid_color
+        )
+        yield np.asarray(image)
+
+
+def _stamp_strips(mosaic, labels, scale_factor, show_grid, show_studs, strip_rows):
+    """Yield (rows * scale, width * scale) palette-slot strips, given each palette entry's stamp slots."""
+    if strip_rows is None:
+        strip_rows = band_rows(mosaic.width * scale_factor * scale_factor * 4)
+    for start in range(0, mosaic.height, strip_rows):
+        yield stamp_cells(labels[mosaic.indices[start:start + strip_rows]], scale_factor, show_grid, show_studs)
+
+
+def png_chunk(kind, data):
+    """One PNG chunk: length, type, data and CRC."""
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def png_scanlines(pixels):
+    """Raw PNG image data for rows of pixels (an (H, W) or (H, W, channels) uint8 array), before zlib."""
+    # Every scanline starts with filter type 0 (None)
+    lines = np.zeros((len(pixels), 1 + pixels[0].size), dtype=np.uint8)
+    lines[:, 1:] = pixels.reshape(len(pixels), -1)
+    return lines.tobytes()
+
+
+def write_png(mosaic, path, scale_factor=SCALE_FACTOR, show_grid=True, show_studs=True,
+              grid_color=GRID_COLOR, strip_rows=None, compress_level=COMPRESS_LEVEL, indexed=True):
+    """Render a Mosaic straight into a PNG file, one strip of mosaic rows at a time.
+
+    Peak memory is one rendered strip (about STRIP_BYTES) whatever the board size.
+    With ``indexed``, boards that need at most 256 colors are written as
+    palette PNGs, one byte per pixel instead of three.
+    """
+    out_width = mosaic.width * scale_factor
+    out_height = mosaic.height * scale_factor
+    paletted = None
+    if indexed:
+        used = np.flatnonzero(mosaic.index_counts())
+        paletted = paletted_labels(mosaic.palette.rgb[used], show_grid, show_studs, grid_color)
+
+    compressor = zlib.compressobj(compress_level)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        if paletted is None:
+            # 8-bit truecolor, no interlacing
+            f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', out_width, out_height, 8, 2, 0, 0, 0)))
+            strips = _render_strips(mosaic, scale_factor, show_grid, show_studs, grid_color, strip_rows)
+        else:
+            # 8-bit palette, no interlacing
+            colors, labels = paletted
+            f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', out_width, out_height, 8, 3, 0, 0, 0)))
+            f.write(png_chunk(b'PLTE', colors.tobytes()))
+            local = np.zeros(len(mosaic.palette), dtype=np.intp)
+            local[used] = np.arange(len(used))
+            strips = _stamp_strips(mosaic, labels[local], scale_factor, show_grid, show_studs, strip_rows)
+        for strip in strips:
+            data = compressor.compress(png_scanlines(strip))
+            if data:
+                f.write(png_chunk(b'IDAT', data))
+        f.write(png_chunk(b'IDAT', compressor.flush()))
+        f.write(png_chunk(b'IEND', b''))
+    return path
+
+
+def write_tiff(mosaic, path, scale_factor=SCALE_FACTOR, show_grid=True, show_studs=True,
+               grid_color=GRID_COLOR, strip_rows=None, compress_level=COMPRESS_LEVEL):
+    """Render a Mosaic into a striped, deflate-compressed RGB TIFF, one strip at a time.
+
+    Each TIFF strip is one rendered strip of mosaic rows. The directory is
+    written after the strips. Files past 4 GB would need BigTIFF and raise
+    ValueError; write a PNG instead.
+    """
+    out_width = mosaic.width * scale_factor
+    out_height = mosaic.height * scale_factor
+    if strip_rows is None:
+        strip_rows = band_rows(mosaic.width * scale_factor * scale_factor * 16)
+
+    offsets = []
+    counts = []
+    with open(path, 'wb') as f:
+        # Little-endian header; the directory offset is patched in at the end
+        f.write(b'II*\x00\x00\x00\x00\x00')
+        for strip in _render_strips(mosaic, scale_factor, show_grid, show_studs, grid_color, strip_rows):
+            data = zlib.compress(strip.tobytes(), compress_level)
+            offsets.append(f.tell())
+            counts.append(len(data))
+            f.write(data)
+            if f.tell() > TIFF_MAX_OFFSET:
+                raise ValueError("Rendered TIFF would exceed 4 GB; write a PNG instead")
+
+        # Arrays that do not fit in a 4-byte directory entry go before the directory
+        bits_offset = f.tell()
+        f.write(struct.pack('<3H', 8, 8, 8))
+        offsets_offset = f.tell()
+        f.write(struct.pack(f'<{len(offsets)}I', *offsets))
+        counts_offset = f.tell()
+        f.write(struct.pack(f'<{len(counts)}I', *counts))
+        if f.tell() % 2:
+            f.write(b'\x00')
+
+        short, long = 3, 4
+        single = len(offsets) == 1
+        entries = [
+            (256, long, 1, out_width),  # ImageWidth
+            (257, long, 1, out_height),  # ImageLength
+            (258, short, 3, bits_offset),  # BitsPerSample
+            (259, short, 1, 8),  # Compression: Adobe deflate
+            (262, short, 1, 2),  # PhotometricInterpretation: RGB
+            (273, long, len(offsets), offsets[0] if single else offsets_offset),  # StripOffsets
+            (277, short, 1, 3),  # SamplesPerPixel
+            (278, long, 1, strip_rows * scale_factor),  # RowsPerStrip
+            (279, long, len(counts), counts[0] if single else counts_offset),  # StripByteCounts
+            (284, short, 1, 1),  # PlanarConfiguration: chunky
+        ]
+        directory_offset = f.tell()
+        if directory_offset > TIFF_MAX_OFFSET:
+            raise ValueError("Rendered TIFF would exceed 4 GB; write a PNG instead")
+        f.write(struct.pack('<H', len(entries)))
+        for tag, kind, count, value in entries:
+            packed = struct.pack('<H', value) + b'\x00\x00' if kind == short and count == 1 else struct.pack('<I', value)
+            f.write(struct.pack('<HHI', tag, kind, count) + packed)
+        f.write(struct.pack('<I', 0))
+        f.seek(4)
+        f.write(struct.pack('<I', directory_offset))
+    return path
+
+
+def write_striped(mosaic, path, scale_factor=SCALE_FACTOR, show_grid=True, show_studs=True,
+                  grid_color=GRID_COLOR, strip_rows=None, compress_level=COMPRESS_LEVEL):
+    """Stream a rendered Mosaic to a .png or .tif/.tiff file chosen by extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.png':
+        writer = write_png
+    elif extension in ('.tif', '.tiff'):
+        writer = write_tiff
+    else:
+        raise ValueError("Striped output must be a .png, .tif or .tiff file")
+    return writer(mosaic, path, scale_factor, show_grid, show_studs, grid_color, strip_rows, compress_level)
+
+
+def baseplates(mosaic, plate_size=PLATE_SIZE):
+    """Yield (plate_row, plate_column, Mosaic) for each plate_size x plate_size section.
+
+    Sections on the right and bottom edges are smaller when the board is not
+    a whole number of plates.
+    """
+    for plate_row, y in enumerate(range(0, mosaic.height, plate_size)):
+        for plate_column, x in enumerate(range(0, mosaic.width, plate_size)):
+            section = mosaic.indices[y:y + plate_size, x:x + plate_size]
+            yield plate_row, plate_column, Mosaic(section, mosaic.palette)
+
+
+def write_baseplate_tiles(mosaic, output_dir, plate_size=PLATE_SIZE, scale_factor=SCALE_FACTOR,
+                          show_grid=True, show_studs=True, grid_color=GRID_COLOR):
+    """Write one instruction image per baseplate plus a plates.json index.
+
+    Images are named plate_<row>_<column>.png. The index records where each
+    plate sits on the board (in studs) and the bricks it needs. Returns the
+    index path.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    plates = []
+    for plate_row, plate_column, section in baseplates(mosaic, plate_size):
+        name = f"plate_{plate_row:02d}_{plate_column:02d}.png"
+        image = render_indices(section.indices, mosaic.palette.rgb, scale_factor, show_grid, show_studs, grid_color)
+        image.save(os.path.join(output_dir, name))
+        parts = PartsList.from_mosaic(section)
+        plates.append({
+            'image': name,
+            'row': plate_row,
+            'column': plate_column,
+            'x': plate_column * plate_size,
+            'y': plate_row * plate_size,
+            'width': section.width,
+            'height': section.height,
+            'parts': [{'name': part.name, 'count': part.count} for part in parts],
+        })
+
+    index_path = os.path.join(output_dir, 'plates.json')
+    with open(index_path, 'w') as f:
+        json.dump({
+            'width': mosaic.width,
+            'height': mosaic.height,
+            'plate_size': plate_size,
+            'plates': plates,
+        }, f, indent=2)
+    return index_path
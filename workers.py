@@ -0,0 +1,22 @@
+"""Per-process generator for the batch and service process pools.
+
+Pass init_worker as a ProcessPoolExecutor initializer (or call it once when
+running in-process); jobs then take worker_generator(), so the palette,
+lookup table and reduced palettes stay warm across jobs.
+"""
+from generator import BasicMosaicGenerator
+
+_generator = None
+
+
+def init_worker(use_lut=True, metric='blend', prefilter=None):
+    """Create this process's generator, attaching a cached lookup table if requested."""
+    global _generator
+    _generator = BasicMosaicGenerator(metric=metric, prefilter=prefilter)
+    if use_lut:
+        _generator.load_lookup_table(build=False)
+
+
+def worker_generator():
+    """The generator created by init_worker in this process."""
+    return _generator